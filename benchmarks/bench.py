@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Dicey benchmarks
+Times each stage of the roll engine over the corpus and reports
+ops/sec and latency percentiles as JSON, optionally checking them
+against a stored baseline.
+
+	python benchmarks/bench.py --out results.json
+	python benchmarks/bench.py --baseline results.json
+
+Exits with status 1 if anything regressed past the thresholds.
+"""
+
+"""
+Imports
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from corpus import crolls, rolls, saved, tros
+from diceClasses import *
+from diceRandom import seedRandom
+
+"""
+Global variables
+"""
+
+warmup = 20
+percentiles = (50, 99)
+
+# A case regresses if its ops/sec drops or its p99 grows by more than these
+opsThreshold = 0.10
+p99Threshold = 0.25
+
+"""
+Cases
+Each case is (name, op, reset), where op is the call timed and reset,
+if not None, is called untimed before each op.
+"""
+
+def rollCases():
+	cases = []
+	for name, expression in rolls:
+		parsed = Roll(expression)
+		if isinstance(parsed.getResult(), str):
+			raise ValueError("Corpus roll " + name + " failed: " + parsed.getResult())
+
+		roll = Roll()
+		plan = roll.getPlan(expression)
+
+		def resolve(roll=roll, plan=plan):
+			for i in range(plan.iterations):
+				for spec in plan.rolls:
+					roll.applySpec(spec)
+					roll.resolve()
+
+		# Results keep their descriptions once built, so each format
+		# gets a freshly parsed roll
+		fresh = [parsed]
+
+		def reparse(expression=expression, fresh=fresh):
+			fresh[0] = Roll(expression)
+
+		def format(fresh=fresh):
+			# Descriptions are built when they're read
+			result = fresh[0].format()
+			if not isinstance(result, str):
+				result.desc
+
+		compiled = normalizeRoll(expression)
+
+		cases.append(("roll.compile." + name, lambda compiled=compiled: roll.compile(compiled), None))
+		cases.append(("roll.parse." + name, lambda expression=expression: Roll().parse(expression), None))
+		cases.append(("roll.parse.cold." + name, lambda expression=expression: Roll().parse(expression), planCache.clear))
+		cases.append(("roll.resolve." + name, resolve, None))
+		cases.append(("roll.format." + name, format, reparse))
+	return cases
+
+def cocCases():
+	return [("coc.parse." + name, lambda expression=expression: CoC().parse(expression), None)
+			for name, expression in crolls]
+
+def rosCases():
+	return [("ros.parse." + name, lambda expression=expression: RoS().parse(expression), None)
+			for name, expression in tros]
+
+def storeCases():
+	"""
+	The saved command store, run in a scratch directory
+	holding the corpus' saved commands
+	"""
+	try:
+		import dicey
+	except ImportError as e:
+		print("Skipping the store benchmarks: " + str(e), file=sys.stderr)
+		return []
+
+	scratch = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, scratch, True)
+	os.chdir(scratch)
+	with open(dicey.rollsFile, 'w') as jsonFile:
+		json.dump(dict(saved), jsonFile)
+
+	# Saving and getting roll through the executor, as the bot does
+	loop = asyncio.new_event_loop()
+	atexit.register(loop.close)
+	return [("store.save", lambda: loop.run_until_complete(dicey.saveCommand("benchmark 4d6 drop 1, 2d20 kh 1")),
+			 lambda: dicey.deleteCommand("benchmark")),
+			("store.get", lambda: loop.run_until_complete(dicey.getCommand(saved[0][0])), None)]
+
+"""
+Timing
+"""
+
+def timeCase(op, reset, seconds):
+	"""
+	Calls op for about seconds and returns its stats
+	"""
+	for i in range(warmup):
+		if reset is not None:
+			reset()
+		op()
+
+	times = []
+	spent = 0
+	while spent < seconds*1e9 or len(times) < warmup:
+		if reset is not None:
+			reset()
+		start = time.perf_counter_ns()
+		op()
+		elapsed = time.perf_counter_ns() - start
+		times.append(elapsed)
+		spent += elapsed
+
+	times = np.array(times)/1000
+	stats = {"calls": len(times),
+			 "opsPerSec": len(times)/(times.sum()/1e6),
+			 "meanUs": float(times.mean())}
+	for p in percentiles:
+		stats["p" + str(p) + "Us"] = float(np.percentile(times, p))
+	return stats
+
+def compare(results, baseline, opsLimit, p99Limit):
+	"""
+	Lists the cases that got slower than baseline by more than the limits
+	"""
+	regressions = []
+	for name, old in baseline["results"].items():
+		new = results["results"].get(name)
+		if new is None:
+			continue
+
+		if new["opsPerSec"] < old["opsPerSec"]*(1 - opsLimit):
+			regressions.append("%s: %.0f ops/sec, was %.0f" % (name, new["opsPerSec"], old["opsPerSec"]))
+		if new["p99Us"] > old["p99Us"]*(1 + p99Limit):
+			regressions.append("%s: p99 %.1fus, was %.1fus" % (name, new["p99Us"], old["p99Us"]))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the dicey roll engine.")
+	parser.add_argument("--seconds", type=float, default=0.5, help="time spent on each case")
+	parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+	parser.add_argument("--out", help="write the JSON results here as well as to stdout")
+	parser.add_argument("--baseline", help="JSON results to check for regressions against")
+	parser.add_argument("--ops-threshold", type=float, default=opsThreshold,
+						help="largest allowed drop in ops/sec, as a fraction")
+	parser.add_argument("--p99-threshold", type=float, default=p99Threshold,
+						help="largest allowed growth in p99 latency, as a fraction")
+	args = parser.parse_args(argv)
+
+	# Baselines are read before the store cases change directory
+	baseline = None
+	if args.baseline:
+		with open(args.baseline) as jsonFile:
+			baseline = json.load(jsonFile)
+	out = os.path.abspath(args.out) if args.out else None
+
+	seedRandom(0)
+	cases = rollCases() + cocCases() + rosCases() + storeCases()
+
+	results = {"python": platform.python_version(),
+			   "numpy": np.__version__,
+			   "seconds": args.seconds,
+			   "results": {}}
+	for name, op, reset in cases:
+		if args.filter in name:
+			results["results"][name] = timeCase(op, reset, args.seconds)
+
+	text = json.dumps(results, indent=2)
+	print(text)
+	if out:
+		with open(out, 'w') as jsonFile:
+			jsonFile.write(text + "\n")
+
+	if baseline is not None:
+		regressions = compare(results, baseline, args.ops_threshold, args.p99_threshold)
+		for regression in regressions:
+			print("Regression: " + regression, file=sys.stderr)
+		if regressions:
+			return 1
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
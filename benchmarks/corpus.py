@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Dicey benchmark corpus
+Expressions the benchmarks run, from the help-doc examples up to
+the biggest rolls the limits allow.
+"""
+
+"""
+Global variables
+"""
+
+# /roll expressions: (name, expression)
+rolls = [("default", ""),
+		 ("bonus", "2"),
+		 ("simple", "2d10+2"),
+		 ("help", "2x3d17+3,2 drop 1,d4"),
+		 ("drop", "4d6 drop 1"),
+		 ("keep", "2d20 keep 1"),
+		 ("kh", "6x4d6 kh 3"),
+		 ("success", "10d10 >= 7"),
+		 ("explode", "3d6!"),
+		 ("explodeAdd", "1d10 >= 7 !! >= 10"),
+		 ("large", "100d1000 drop 20"),
+		 ("worstIterations", "50x4d6 drop 1 >= 10, d20 >= 10"),
+		 ("worstExplode", "50x10d10 drop 2 >= 50 !! >= 70, 2d20 kh 1 >= 20 !"),
+		 ("worstDescription", "50x60d100 dh 10 >= 2500 ! >= 3000, 1d100 <= 5")]
+
+# /croll expressions
+crolls = [("default", ""),
+		  ("threshold", "60t"),
+		  ("bonus", "b"),
+		  ("penalty", "2p70t")]
+
+# /tros expressions
+tros = [("pool", "4/7"),
+		("help", "2x 3/6, 1d6"),
+		("large", "10x 20/6"),
+		("simple", "3d6+2")]
+
+# Commands saved in the store before timing it, as (name, roll)
+saved = [("command" + str(i), rolls[1 + i % (len(rolls) - 1)][1]) for i in range(200)]
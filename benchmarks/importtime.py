@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Dicey import time benchmark
+Imports each module in a fresh interpreter under -X importtime and
+reports the quickest of a few runs as JSON, checking it against a
+budget in milliseconds.
+
+	python benchmarks/importtime.py --out imports.json
+	python benchmarks/importtime.py --runs 10
+
+Exits with status 1 if anything took longer than its budget.
+"""
+
+"""
+Imports
+"""
+import argparse
+import compileall
+import json
+import os
+import platform
+import subprocess
+import sys
+
+"""
+Global variables
+"""
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds each module may take to import, with everything it
+# imports. The roll engine shouldn't load numpy until the first roll,
+# and the bot shouldn't load discord until it connects.
+budgets = {"diceClasses": 25,
+		   "diceBatch": 50,
+		   "dicey": 120}
+
+"""
+Measurement
+"""
+
+def importTime(module):
+	"""
+	Milliseconds module took to import in a fresh interpreter
+	"""
+	process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+							 cwd=root, capture_output=True, text=True, check=True)
+	for line in process.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		fields = line.split("|")
+		if len(fields) == 3 and fields[2].strip() == module:
+			return int(fields[1])/1000
+	raise RuntimeError("No import time for " + module)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Time importing the dicey modules.")
+	parser.add_argument("--runs", type=int, default=5, help="imports of each module, keeping the quickest")
+	parser.add_argument("--out", help="write the JSON results here as well as to stdout")
+	args = parser.parse_args(argv)
+
+	# Compiling first keeps the first run from paying for it
+	compileall.compile_dir(root, maxlevels=0, quiet=1)
+
+	results = {"python": platform.python_version(),
+			   "runs": args.runs,
+			   "results": {}}
+	over = []
+	for module, budget in budgets.items():
+		ms = min([importTime(module) for i in range(args.runs)])
+		results["results"][module] = {"ms": round(ms, 2), "budgetMs": budget}
+		if ms > budget:
+			over.append("%s: %.1fms, budget %dms" % (module, ms, budget))
+
+	text = json.dumps(results, indent=2)
+	print(text)
+	if args.out:
+		with open(args.out, 'w') as jsonFile:
+			jsonFile.write(text + "\n")
+
+	for line in over:
+		print("Over budget: " + line, file=sys.stderr)
+	return 1 if over else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Dicey batch roller
+Rolls expressions without Discord, from the command line, a file or
+stdin, and writes a JSON object per expression, one per line, in the
+order they came in.
+
+	python -m dicey 2d6+3 "4x4d6 drop 1"
+	python -m dicey --type tros --seed 7 --workers 4 --file encounters.txt
+	make-encounters | python -m dicey -
+
+Each object has the expression as "input", then either its "title",
+"description" and "colour" or an "error".
+"""
+
+"""
+Imports
+"""
+import argparse
+import concurrent.futures
+import json
+import sys
+from collections import deque
+from itertools import chain
+from itertools import islice
+
+from diceClasses import *
+from diceRandom import DiceRandom
+
+"""
+Global variables
+"""
+
+rollTypes = {"roll": Roll, "croll": CoC, "tros": RoS}
+
+# Expressions rolled with each random stream, and chunks each worker
+# may have waiting, so a stream is never read much further ahead
+# than it's written out
+chunkSize = 256
+aheadLimit = 2
+
+"""
+Evaluation
+"""
+
+def evaluate(rollClass, expression, rng):
+	"""
+	The formatted result of an expression as a JSON-friendly dict
+	"""
+	roll = rollClass(rng=rng)
+	roll.parse(expression)
+	result = roll.format()
+
+	if result is ValueError:
+		return {"input": expression, "error": roll.__fail__}
+	elif isinstance(result, str):
+		return {"input": expression, "error": result}
+
+	return {"input": expression, "title": result.title, "description": result.desc, "colour": result.colour}
+
+def evaluateChunk(typeName, expressions, seed, index):
+	"""
+	JSON lines for a chunk of expressions, rolled with stream index
+	of seed, so the output only depends on the seed and not on which
+	worker rolled it
+	"""
+	rollClass = rollTypes[typeName]
+	rng = DiceRandom(seed, index)
+	return [json.dumps(evaluate(rollClass, expression, rng)) for expression in expressions]
+
+def chunks(expressions, size):
+	expressions = iter(expressions)
+	while True:
+		chunk = list(islice(expressions, size))
+		if not chunk:
+			return
+		yield chunk
+
+def evaluateAll(expressions, typeName="roll", seed=None, workers=1):
+	"""
+	Yields the JSON line of each expression in order. With more than
+	one worker, chunks are rolled in worker processes, a few at a time.
+	"""
+	if seed is None:
+		seed = DiceRandom().seed
+
+	numbered = enumerate(chunks(expressions, chunkSize), 1)
+	if workers <= 1:
+		for index, chunk in numbered:
+			yield from evaluateChunk(typeName, chunk, seed, index)
+		return
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+		pending = deque()
+		for index, chunk in numbered:
+			pending.append(pool.submit(evaluateChunk, typeName, chunk, seed, index))
+			if len(pending) >= workers*aheadLimit:
+				yield from pending.popleft().result()
+		while pending:
+			yield from pending.popleft().result()
+
+def readLines(lines):
+	"""
+	Expressions from lines of text, skipping blank lines
+	"""
+	for line in lines:
+		line = line.strip()
+		if line:
+			yield line
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m dicey",
+									 description="Roll dice expressions without Discord, writing a JSON object per line. "
+												 "Run without arguments to start the bot.")
+	parser.add_argument("expressions", nargs="*", help="expressions to roll; - reads more from stdin, one per line")
+	parser.add_argument("--file", help="read expressions from this file, one per line")
+	parser.add_argument("--type", choices=sorted(rollTypes), default="roll", help="kind of roll (default roll)")
+	parser.add_argument("--seed", type=int, help="seed for reproducible rolls")
+	parser.add_argument("--workers", type=int, default=1, help="worker processes to roll in (default 1)")
+	args = parser.parse_args(argv)
+
+	sources = []
+	for expression in args.expressions:
+		if expression == "-":
+			sources.append(readLines(sys.stdin))
+		else:
+			sources.append([expression])
+
+	inputFile = None
+	if args.file:
+		try:
+			inputFile = open(args.file)
+		except OSError as e:
+			print("Couldn't read " + args.file + ": " + str(e), file=sys.stderr)
+			return 1
+		sources.append(readLines(inputFile))
+
+	try:
+		for line in evaluateAll(chain.from_iterable(sources), args.type, args.seed, args.workers):
+			sys.stdout.write(line + "\n")
+	finally:
+		if inputFile is not None:
+			inputFile.close()
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
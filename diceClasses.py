@@ -7,13 +7,25 @@ Thanks to the bot Dorian for the basic structure.
 """
 Imports
 """
-import discord
-import re
-import logging
-import asyncio
-from os import environ
-from random import randint
-from dicey_token import token
+import heapq
+import threading
+import time
+from array import array
+from collections import namedtuple
+from collections import OrderedDict
+from diceOdds import explodeChance
+from diceOdds import percentileDistribution
+from diceOdds import specDistribution
+from diceOdds import tierChances
+from diceOdds import tierDice
+from diceOdds import tierNames
+from diceOdds import tierTable
+from diceLazy import lazyImport
+from diceRandom import getRandom
+
+logging = lazyImport("logging")
+np = lazyImport("numpy")
+re = lazyImport("re")
 
 """
 Global variables
@@ -32,6 +44,7 @@ Defaults to rolling 1d20
 [+ or - bonus] adds or subtracts a fixed amount to the total.
 [drop] drops the lowest N rolls from the total, where N defaults to 1 or can be set by appending an integer. It resets to 0 unless a roll is being repeated.
 [keep] keeps the lowest N rolls, dropping the higher from the total, where N defaults to 1 or can be set by appending an integer. It resets to 0 unless a roll is being repeated.
+[kh] and [dh] keep or drop the highest N rolls instead, in the same way. Only one of drop, keep, kh and dh can be used per roll.
 [>/<[=]] sets a boundary above or below which rolls will be counted as a success, and reported as successes or failures instead of raw numbers.
 [!] causes World of Darkness style exploding dice (rolls above a certain value trigger a new roll). It applies to the total xdy+z, not to each individual dy. It defaults to the maximum number; set a boundary with [>[=]] or [<[=]].
 [!!] causes Shadowrun or Riddle of Steel style exploding dice, in which a new roll is added to the previous value.
@@ -121,22 +134,308 @@ Examples:
 Setup functions and classes
 """
 
+# A compiled roll plan is the parsed form of an expression: how many
+# times to iterate, and the settings of each comma-separated roll.
+# Plans are immutable so they can be cached and shared between rolls.
+RollSpec = namedtuple("RollSpec", ["dice", "type", "bonus", "drop", "keepFlag", "highFlag",
+								   "success", "lessThanFlag",
+								   "explode", "explodeFlag", "explodeType"])
+RollPlan = namedtuple("RollPlan", ["iterations", "rolls"])
+
+# Version of the saved form of a plan (see Roll.dumpPlan). Bump it when
+# RollSpec or what its fields mean changes; plans saved under another
+# version are compiled again from their expression.
+planVersion = 1
+
+# A Riddle of Steel pool: the same spec rolled once per die in the pool
+PoolSpec = namedtuple("PoolSpec", ["pool", "spec"])
+
+# Arrays describing n independent evaluations of one roll, one row each.
+# totals include every level of an explosion chain; kept and dropped are
+# the dice of the first level; successes is None without a threshold.
+BatchResult = namedtuple("BatchResult", ["totals", "kept", "dropped", "successes", "explosions"])
+
+# Explosion details, kept on the first result of an exploding roll: how
+# many explosions followed it, the chance of any one roll exploding
+# (None if the roll didn't explode, as it's only worked out then, or if
+# there are too many outcomes to work it out) and each total.
+ExplosionChain = namedtuple("ExplosionChain", ["explosions", "chance", "totals"])
+
+# The dice of Riddle of Steel pools rolled together, one row per die.
+# totals include added explosions; levels holds a (rows, kept, dropped,
+# totals) tuple per explosion level, for the rows that exploded into it.
+PoolBatch = namedtuple("PoolBatch", ["spec", "kept", "dropped", "totals", "successes", "levels"])
+
+def normalizeRoll(message):
+	"""
+	Normalizes an expression for use as a plan cache key.
+	Runs of spaces are never significant to the parser.
+	"""
+	return re.sub(r" +", " ", message.strip())
+
+class PlanCache:
+	"""
+	Bounded least-recently-used cache of compiled roll plans, shared
+	by the threads rolls run on
+	"""
+
+	def __init__(self, size=256):
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self.plans = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			plan = self.plans.get(key)
+			if plan is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.plans.move_to_end(key)
+		return plan
+
+	def put(self, key, plan):
+		with self.lock:
+			self.plans[key] = plan
+			self.plans.move_to_end(key)
+			while len(self.plans) > self.size:
+				self.plans.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.plans.clear()
+			self.hits = 0
+			self.misses = 0
+
+planCache = PlanCache()
+
 class DiceResult:
+	"""
+	Result of a single roll. The description is only built when
+	something asks for it; until then only the numbers are kept.
+	"""
+
+	__slots__ = ("title", "total", "colour", "rollList", "dropList",
+				 "spec", "depth", "explosions", "levels", "parts", "chain", "descText")
+
+	COL_CRIT_SUCCESS = 0xFFFFFF
+	COL_EXTR_SUCCESS = 0xf1c40f
+	COL_HARD_SUCCESS = 0x2ecc71
+	COL_NORM_SUCCESS = 0x2e71cc
+	COL_NORM_FAILURE = 0xe74c3c
+	COL_CRIT_FAILURE = 0x992d22
+
+	DESC_LIMIT = 2048
+
 	def __init__(self):
 		self.title = ""
-		self.desc = ""
-		self.rollList = []
-		self.dropList = []
 		self.total = 0
+		self.colour = self.COL_NORM_SUCCESS
+		self.rollList = array("i")
+		self.dropList = array("i")
+
+		# What the description is built from: the spec rolled, how deep
+		# in an explosion chain it was, how many explosions followed it,
+		# and any added explosion levels or combined results to show too
+		self.spec = None
+		self.depth = 0
+		self.explosions = 0
+		self.levels = ()
+		self.parts = None
+		self.chain = None
+		self.descText = None
+
+	@property
+	def desc(self):
+		if self.descText is None:
+			self.descText = self.render()
+		return self.descText
+
+	@desc.setter
+	def desc(self, text):
+		self.descText = text
+
+	@property
+	def titles(self):
+		return [self.title]
+
+	def render(self):
+		"""
+		Builds the description string
+		"""
 
-		self.COL_CRIT_SUCCESS = 0xFFFFFF
-		self.COL_EXTR_SUCCESS = 0xf1c40f
-		self.COL_HARD_SUCCESS = 0x2ecc71
-		self.COL_NORM_SUCCESS = 0x2e71cc
-		self.COL_NORM_FAILURE = 0xe74c3c
-		self.COL_CRIT_FAILURE = 0x992d22
+		# Several results one after another, giving up once too long
+		if self.parts is not None:
+			descs = []
+			length = -1
+			for part in self.parts:
+				descs.append(part.desc)
+				length += len(descs[-1]) + 1
+				if length >= self.DESC_LIMIT:
+					return "description too long; surpressed"
+			return "\n".join(descs)
+
+		spec = self.spec
+		if spec is None:
+			return ""
+
+		# Begin constructing description string
+		prelude = ""
+		if self.depth > 0:
+			prelude += "Explosion:  "
+
+		# Basic roll
+		prelude += str(spec.dice) + "d" + str(spec.type)
+		if spec.bonus != 0:
+			prelude += " + " + str(spec.bonus)
+
+		# Success indicator
+		if spec.success is not None:
+			if self.depth == 0 or spec.explodeType == "stack":
+				if not spec.lessThanFlag:
+					prelude += ' \u2265 ' 
+				else:
+					prelude += ' \u2264 '
+				prelude += str(spec.success)
+
+		# Explosion indicator
+		if spec.explode is not None:
+			if spec.explodeType == "stack":
+				prelude += " ! "
+			elif spec.explodeType == "add":
+				prelude += " !! "
+
+			if not spec.explodeFlag:
+				prelude += "\u2265 "
+			else:
+				prelude += "\u2264 "
+			prelude += str(spec.explode)
+
+		# Show rolls made
+		prelude += ':  '
+		resultDesc = ' + '.join([str(i) for i in self.rollList])
+
+		# Show bonus dice
+		if spec.bonus == 0:
+			bonusDesc = ''
+		else:
+			resultDesc = '(' + resultDesc
+			bonusDesc = ') + ' + str(spec.bonus)
+
+			# Show added bonus dice properly
+			if spec.explode is not None and self.explosions > 0 and self.depth == 0:
+				bonusDesc += '*' + str(self.explosions + 1)
+		desc = resultDesc + bonusDesc
+
+		# Show total if applicable
+		if '+' in desc:
+			desc = prelude + desc + ' = ' + str(self.total)
+		else:
+			desc = prelude + str(self.total)
+
+		# Show dropped dice if applicable
+		if len(self.dropList) > 0:
+			desc += '  (dropped ' + ', '.join([str(i) for i in self.dropList]) + ')'
+
+		# Show success (if not an added explosion die)
+		if not (self.depth > 0 and spec.explodeType == "add"):
+			if self.title == 'Success':
+				if not spec.lessThanFlag:
+					desc += '  \u2265 '
+				else:
+					desc += '  \u2264 '
+				desc += str(spec.success)
+
+			elif self.title == 'Failure':
+				desc += '  < ' + str(spec.success)
+
+		# Clean up the description
+		desc = desc.replace("+-", "-").replace("+ -", "- ")
+
+		# Show added exploded dice properly
+		for level in self.levels:
+			desc += "\n" + level.desc
+
+		return desc
+
+
+class PoolResult:
+	"""
+	Results of the dice from start to stop of a PoolBatch: a title
+	for each, and a DiceResult for each only once the description
+	is asked for
+	"""
+
+	__slots__ = ("batch", "start", "stop", "titles", "colour", "descText")
+
+	def __init__(self, batch, start, stop):
+		self.batch = batch
+		self.start = start
+		self.stop = stop
+		self.titles = ["Success" if success else "Failure" for success in batch.successes[start:stop].tolist()]
+		self.colour = DiceResult.COL_NORM_SUCCESS
+		if len(self.titles) == 1:
+			self.colour = DiceResult.COL_HARD_SUCCESS if self.titles[0] == "Success" else DiceResult.COL_NORM_FAILURE
+		self.descText = None
+
+	@property
+	def desc(self):
+		if self.descText is None:
+			descs = []
+			length = -1
+			for i in range(self.start, self.stop):
+				descs.append(self.dieResult(i).desc)
+				length += len(descs[-1]) + 1
+				if length >= DiceResult.DESC_LIMIT:
+					break
+			self.descText = "\n".join(descs)
+		return self.descText
+
+	def dieResult(self, i):
+		"""
+		The DiceResult resolve would have made for die i
+		"""
+		batch = self.batch
+		spec = batch.spec
+
+		# A die is in each explosion level up to the first it isn't in
+		levels = []
+		for rows, kept, dropped, totals in batch.levels:
+			row = np.searchsorted(rows, i)
+			if row == len(rows) or rows[row] != i:
+				break
+			levels.append((array("i", kept[row].tolist()), array("i", dropped[row].tolist()), int(totals[row])))
+
+		ret = DiceResult()
+		ret.spec = spec
+		ret.total = int(batch.totals[i])
+		ret.rollList = array("i", batch.kept[i].tolist())
+		ret.dropList = array("i", batch.dropped[i].tolist())
+		ret.explosions = len(levels)
+		ret.title = self.titles[i - self.start]
+		ret.colour = DiceResult.COL_HARD_SUCCESS if ret.title == "Success" else DiceResult.COL_NORM_FAILURE
+
+		# Explosions are added on, and shown after the die
+		explosions = []
+		for depth, (kept, dropped, total) in enumerate(levels):
+			ret.rollList.extend(kept)
+			ret.rollList.extend(dropped)
+
+			level = DiceResult()
+			level.spec = spec
+			level.depth = depth + 1
+			level.total = total
+			level.title = str(total)
+			level.rollList = kept
+			level.dropList = dropped
+			level.explosions = len(levels) - depth - 1
+			explosions.append(level)
+		ret.levels = tuple(explosions)
+
+		return ret
 
-		self.colour = self.COL_NORM_SUCCESS
 
 class Roll:
 
@@ -145,20 +444,32 @@ class Roll:
 	bonus = 0
 	drop = 0
 	__keepFlag__ = False
+	__highFlag__ = False
 	result = []
 
-	rollsLimit = 50
+	# Seconds the last parse spent compiling and rolling
+	parseTime = None
+	resolveTime = None
+
+	# time.monotonic() past which rolling gives up, if set
+	deadline = None
+
+	rollsLimit = 200
 	digitLimit = 10000
+	explodeLimit = 1000
+	explodeBatch = 10000
 
-	__commands__ = r"(drop|keep|>=|=>|<=|=<|/|[\+!><=d ])"
+	__commands__ = r"(drop|keep|kh|dh|>=|=>|<=|=<|/|[\+!><=d ])"
 	__fail__ = "Couldn't parse input. Use /help to get more information."
 	__mult__ = "Command appears more than once."
 	__incompatible__ = "Incompatible commands used."
 	__overRolls__ = "Sorry... I'd rather not print that many rolls."
 	__overDigits__ = "Hey! Stop trying to break me with big numbers :("
 	__badExplode__ = "I tried to explode the dice like you asked, but there were too many of them.\nWhatever you were doing, you probably won."
+	__tooComplex__ = "That roll has too many possible outcomes for me to work out exactly."
+	__tooSlow__ = "That roll took too long, so I gave up on it :hourglass:"
 
-	def __init__(self, message=None):
+	def __init__(self, message=None, rng=None):
 		# Default setup for a D&D-style roller which can be
 		# modified to perform nearly any roll
 
@@ -169,6 +480,7 @@ class Roll:
 		self.explodeType = "stack"
 
 		self.message = message
+		self.rng = getRandom() if rng is None else rng
 
 		if self.message is not None:
 			self.parse()
@@ -188,17 +500,26 @@ class Roll:
 	def getDigitLimit(self):
 		return self.digitLimit
 
+	def getExplodeLimit(self):
+		return self.explodeLimit
+
 	def setRollsLimit(self, n):
 		self.rollsLimit = n
 
 	def setDigitLimit(self, n):
 		self.digitLimit = n
 
+	def setExplodeLimit(self, n):
+		self.explodeLimit = n
+
 	def getResult(self):
 		return self.result
 
+	def overDeadline(self):
+		return self.deadline is not None and time.monotonic() > self.deadline
+
 	def rollDie(self, minimum=1, maximum=20):
-		return randint(minimum,maximum)
+		return self.rng.randint(minimum,maximum)
 
 	def __reset__(self):
 		self.dice = 1
@@ -206,185 +527,674 @@ class Roll:
 		self.bonus = 0
 		self.drop = 0
 		self.__keepFlag__ = False
+		self.__highFlag__ = False
 		self.success = None
 		self.__lessThanFlag__ = False
 		self.explode = None
 		self.__explodeFlag__ = False
 		self.explodeType = "stack"		
 
-	def resolve(self, depth=0):
+	def isSuccess(self, spec, total):
+		if not spec.lessThanFlag:
+			return total >= spec.success
+		return total <= spec.success
+
+	def isExplode(self, spec, total):
+		if not spec.explodeFlag:
+			return total >= spec.explode
+		return total <= spec.explode
+
+	def explodesForever(self, spec):
 		"""
-		Creates a DiceResult object given an xdy+z - style roll
-		contained in a Roll() class
+		Whether every roll of spec explodes, so a chain never ends
+		"""
+		if spec.keepFlag:
+			kept = min(spec.drop, spec.dice)
+		else:
+			kept = spec.dice - spec.drop
+
+		if spec.type == 0:
+			lowest = highest = spec.bonus
+		else:
+			lowest = kept + spec.bonus
+			highest = kept*spec.type + spec.bonus
+
+		return self.isExplode(spec, highest if spec.explodeFlag else lowest)
+
+	def getExplodeChance(self, spec):
+		"""
+		Exact chance of one roll of spec exploding, or None if it has
+		too many outcomes to work out
+		"""
+		try:
+			return explodeChance(spec)
+		except OverflowError:
+			return None
+
+	def drawLevels(self, spec, count, exploding, chance, rng):
 		"""
+		Draws count explosion levels from the rolls that do (or don't)
+		explode, rolling vectorized batches sized by their chance
+		"""
+		levels = []
+		while len(levels) < count:
+			need = count - len(levels)
+			kept, dropped = self.rollDice(spec, min(int(need/chance*1.25) + 4, self.explodeBatch), rng)
+			totals = kept.sum(axis=1) + spec.bonus
+
+			for i in np.flatnonzero(self.isExplode(spec, totals) == exploding)[:need]:
+				levels.append((array("i", kept[i].tolist()), array("i", dropped[i].tolist()), int(totals[i])))
+
+		return levels
 
-		if depth > self.rollsLimit:
+	def explodeChain(self, spec, chance):
+		"""
+		Rolls the rest of an explosion chain once the first roll has
+		exploded. Rather than rolling until a roll doesn't explode, the
+		number of explosions is drawn straight from the chance of each
+		roll exploding, then the levels are drawn to match.
+		Returns a list of (kept, dropped, total) levels or an error string.
+		"""
+		rng = self.rng
+
+		if chance is None:
+			# Too many outcomes to know the chance; roll level by level
+			levels = []
+			while True:
+				if len(levels) >= self.explodeLimit:
+					return self.__badExplode__
+				kept, dropped = self.rollDice(spec, 1, rng)
+				total = int(kept.sum()) + spec.bonus
+				levels.append((array("i", kept[0].tolist()), array("i", dropped[0].tolist()), total))
+				if not self.isExplode(spec, total):
+					return levels
+
+		if chance >= 1:
 			return self.__badExplode__
 
-		result = []
-		retList = []
+		# Further explosions after the first one
+		count = int(rng.geometric(1 - chance)) - 1
+		if count + 1 > self.explodeLimit:
+			return self.__badExplode__
 
-		# roll
-		for die in range(self.dice):
-			if self.type == 0:
-				result.append(0)
+		return self.drawLevels(spec, count, True, chance, rng) + self.drawLevels(spec, 1, False, 1 - chance, rng)
+
+	def levelResult(self, spec, depth, kept, dropped, total, explosions):
+		"""
+		Constructs the DiceResult for one level of a roll
+		"""
+		ret = DiceResult()
+		ret.total = total
+		ret.rollList = kept
+		ret.dropList = dropped
+		ret.spec = spec
+		ret.depth = depth
+		ret.explosions = explosions
+
+		# Set success indicators (if not an added explosion die)
+		ret.title = str(total)
+		if spec.success is not None and not (depth > 0 and spec.explodeType == "add"):
+			if self.isSuccess(spec, total):
+				ret.title = "Success"
+				ret.colour = ret.COL_HARD_SUCCESS
 			else:
-				result.append(self.rollDie(1, self.type))
+				ret.title = "Failure"
+				ret.colour = ret.COL_NORM_FAILURE
 
-		# drop lowest or keep lowest, if applicable
-		dropList = []
-		if not self.__keepFlag__:
-			while len(dropList) < self.drop:
-				dropList.append(min(result))
-				result.remove(min(result))
+		return ret
+
+	def selectDice(self, spec, result):
+		"""
+		Splits a roll into kept and dropped dice. drop and kh take the
+		dropped dice from the bottom, keep and dh from the top; ties go
+		to the earliest die.
+		"""
+
+		if not spec.keepFlag:
+			if spec.drop > len(result):
+				raise ValueError
+			count = spec.drop
 		else:
-			while len(result) > self.drop:
-				dropList.append(max(result))
-				result.remove(max(result))
+			count = max(len(result) - spec.drop, 0)
+
+		if count == 0:
+			return result, array("i")
+
+		fromTop = spec.keepFlag != spec.highFlag
+
+		# Big pools of small dice: count faces instead of sorting
+		if 0 < spec.type < len(result):
+			counts = [0]*(spec.type + 1)
+			for die in result:
+				counts[die] += 1
+
+			# Work in from the end being dropped, noting how many of
+			# each face go
+			dropCounts = [0]*(spec.type + 1)
+			dropped = array("i")
+			for face in (range(spec.type, 0, -1) if fromTop else range(1, spec.type + 1)):
+				dropCounts[face] = min(counts[face], count - len(dropped))
+				dropped.extend([face]*dropCounts[face])
+				if len(dropped) == count:
+					break
+
+			kept = array("i")
+			for die in result:
+				if dropCounts[die] > 0:
+					dropCounts[die] -= 1
+				else:
+					kept.append(die)
+
+		else:
+			if fromTop:
+				dropIndex = heapq.nlargest(count, range(len(result)), key=result.__getitem__)
+			else:
+				dropIndex = heapq.nsmallest(count, range(len(result)), key=result.__getitem__)
+
+			dropped = array("i", [result[i] for i in dropIndex])
+			dropIndex = set(dropIndex)
+			kept = array("i", [die for i, die in enumerate(result) if i not in dropIndex])
+
+		return kept, dropped
+
+	def resolve(self, rolls=None):
+		"""
+		Creates a DiceResult object given an xdy+z - style roll
+		contained in a Roll() class. rolls are dice already rolled
+		for it, if any.
+		"""
+
+		spec = self.getSpec()
+
+		# roll
+		if rolls is not None:
+			result = array("i", rolls)
+		elif self.type == 0:
+			result = array("i", [0])*self.dice
+		else:
+			result = array("i", self.rng.dice(self.type, self.dice))
+
+		# drop or keep, if applicable
+		result, dropList = self.selectDice(spec, result)
 
 		# Add up
 		CombinedResult = sum(result) + self.bonus
 
 		# Explode
+		levels = []
+		chain = None
 		if self.explode is not None:
-			# Stacking explosions
-			if not self.__explodeFlag__:
-				if CombinedResult >= self.explode:
-					ret = self.resolve(depth + 1)
+			chance = None
+			if self.isExplode(spec, CombinedResult):
+				chance = self.getExplodeChance(spec)
+				levels = self.explodeChain(spec, chance)
+				if isinstance(levels, str):
+					return levels
+			chain = ExplosionChain(len(levels), chance, (CombinedResult,) + tuple([level[2] for level in levels]))
 
-					if type(ret) is str:
-						return ret
-					else:
-						retList.extend(ret)
+		# Notate adding explosions correctly.
+		if self.explodeType == "add":
+			for kept, dropped, total in levels:
+				CombinedResult += total
+				result.extend(kept)
+				result.extend(dropped)
+
+		# Construct DiceResult objects to return info;
+		# descriptions are left for them to build if needed
+		retList = [self.levelResult(spec, 0, result, dropList, CombinedResult, len(levels))]
+		retList[0].chain = chain
+
+		explosions = [self.levelResult(spec, depth + 1, kept, dropped, total, len(levels) - depth - 1)
+					  for depth, (kept, dropped, total) in enumerate(levels)]
+
+		# Show added exploded dice properly
+		if self.explodeType == "add":
+			retList[0].levels = tuple(explosions)
+		else:
+			retList.extend(explosions)
 
-			# Adding explosions
-			else:
-				if CombinedResult <= self.explode:
-					ret = self.resolve(depth + 1)
+		return retList
 
-					if type(ret) is str:
-						return ret
-					else:
-						retList.extend(ret)
+	def rollDice(self, spec, n, rng):
+		"""
+		Rolls the dice of spec n times over as an (n, dice) array
+		and splits it into kept and dropped dice
+		"""
 
-		# Notate adding explosions correctly.
-		if depth == 0 and self.explodeType == "add":
-			for ret in retList[::-1]:
-				CombinedResult += ret.total
-				result.extend(ret.rollList)
-				result.extend(ret.dropList)
-
-		# Check for success, if applicable
-		success = ""
-		if self.success is not None:
-			if not self.__lessThanFlag__:
-				if CombinedResult >= self.success:
-					success = "Success"
-				else:
-					success = "Failure"
-			else:
-				if CombinedResult <= self.success:
-					success = "Success"
-				else:
-					success = "Failure"
+		if spec.type == 0:
+			rolls = np.zeros((n, spec.dice), dtype=np.int64)
+		else:
+			rolls = rng.integers(1, spec.type, size=(n, spec.dice), endpoint=True)
 
-		# Begin constructing description string
-		prelude = ""
-		if depth > 0:
-			prelude += "Explosion:  "
+		# Drop or keep, taking the earliest die on ties like selectDice
+		if not spec.keepFlag:
+			if spec.drop > spec.dice:
+				raise ValueError
+			count = spec.drop
+		else:
+			count = max(spec.dice - spec.drop, 0)
 
-		# Basic roll
-		prelude += str(self.dice) + "d" + str(self.type)
-		if self.bonus != 0:
-			prelude += " + " + str(self.bonus)
+		if spec.keepFlag != spec.highFlag:
+			dropIndex = np.argsort(-rolls, axis=1, kind="stable")[:, :count]
+		else:
+			dropIndex = np.argsort(rolls, axis=1, kind="stable")[:, :count]
 
-		# Success indicator
-		if self.success is not None:
-			if depth == 0 or self.explodeType == "stack":
-				if not self.__lessThanFlag__:
-					prelude += ' \u2265 ' 
-				else:
-					prelude += ' \u2264 '
-				prelude += str(self.success)
+		if dropIndex.shape[1] == 0:
+			return rolls, rolls[:, :0]
 
-		# Explosion indicator
-		if self.explode is not None:
-			if self.explodeType == "stack":
-				prelude += " ! "
-			elif self.explodeType == "add":
-				prelude += " !! "
+		dropped = np.take_along_axis(rolls, dropIndex, axis=1)
+		keepMask = np.ones(rolls.shape, dtype=bool)
+		np.put_along_axis(keepMask, dropIndex, False, axis=1)
+		kept = rolls[keepMask].reshape(n, spec.dice - dropIndex.shape[1])
 
-			if not self.__explodeFlag__:
-				prelude += "\u2265 "
-			else:
-				prelude += "\u2264 "
-			prelude += str(self.explode)
+		return kept, dropped
 
-		# Show rolls made
-		prelude += ':  '
-		resultDesc = ' + '.join([str(i) for i in result])
+	def resolveMany(self, spec, n, rng):
+		"""
+		Vectorized counterpart to resolve: rolls spec n times at once
+		and returns a BatchResult, or an error string
+		"""
 
-		# Show bonus dice
-		if self.bonus == 0:
-			bonusDesc = ''
-		else:
-			resultDesc = '(' + resultDesc
-			bonusDesc = ') + ' + str(self.bonus)
+		kept, dropped = self.rollDice(spec, n, rng)
+		levelTotals = kept.sum(axis=1) + spec.bonus
+		totals = levelTotals.copy()
+		explosions = np.zeros(n, dtype=np.int64)
+
+		def isSuccess(values):
+			if not spec.lessThanFlag:
+				return values >= spec.success
+			return values <= spec.success
+
+		# Stacking explosions count a success per level
+		stackSuccess = spec.success is not None and spec.explodeType == "stack"
+		if stackSuccess:
+			successes = isSuccess(levelTotals).astype(np.int64)
+
+		# Explode the rows that need it, one level at a time
+		if spec.explode is not None:
+			active = np.flatnonzero(self.isExplode(spec, levelTotals))
+			depth = 0
+			while len(active) > 0:
+				depth += 1
+				if depth > self.explodeLimit:
+					return self.__badExplode__
+
+				levelKept, levelDropped = self.rollDice(spec, len(active), rng)
+				levelTotals = levelKept.sum(axis=1) + spec.bonus
+
+				totals[active] += levelTotals
+				explosions[active] += 1
+				if stackSuccess:
+					successes[active] += isSuccess(levelTotals)
+
+				active = active[self.isExplode(spec, levelTotals)]
+
+		# Adding explosions are checked once, against the whole chain
+		if spec.success is None:
+			successes = None
+		elif not stackSuccess:
+			successes = isSuccess(totals).astype(np.int64)
+
+		return BatchResult(totals, kept, dropped, successes, explosions)
+
+	@classmethod
+	def rollMany(cls, message, n, rng=None):
+		"""
+		Rolls n independent evaluations of message, one vectorized
+		pass per roll. Returns a list with a BatchResult for each roll
+		the expression makes (iterations included), or an error string.
+		rng is a DiceRandom stream, the calling thread's by default.
+		"""
 
-			# Show added bonus dice properly
-			if self.explode is not None and len(retList) > 0 and depth == 0:
-				bonusDesc += '*' + str(len(retList) + 1)
-		desc = resultDesc + bonusDesc
+		roll = cls(rng=rng)
+		rng = roll.rng
+		try:
+			plan = roll.getPlan(message)
+			if plan is ValueError:
+				return roll.__fail__
+			elif isinstance(plan, str):
+				return plan
+
+			results = []
+			for i in range(plan.iterations):
+				for spec in plan.rolls:
+					res = roll.resolveMany(spec, n, rng)
+					if isinstance(res, str):
+						return res
+					results.append(res)
+
+			return results
 
-		# Show total if applicable
-		if '+' in desc:
-			desc = prelude + desc + ' = ' + str(CombinedResult)
+		except:
+			return roll.__fail__
+
+	@classmethod
+	def distribution(cls, message):
+		"""
+		Works out the exact odds of message without rolling. Returns a
+		list with a Distribution for each roll in the expression (not
+		repeated for iterations), or an error string.
+		"""
+
+		roll = cls()
+		plan = roll.getPlan(message)
+		if plan is ValueError:
+			return roll.__fail__
+		elif isinstance(plan, str):
+			return plan
+
+		try:
+			return [specDistribution(spec, roll.explodeLimit) for spec in plan.rolls]
+		except OverflowError:
+			return roll.__tooComplex__
+		except:
+			return roll.__fail__
+
+	def describe(self, spec):
+		"""
+		Writes a spec back out as an expression the parser accepts
+		"""
+
+		if isinstance(spec, PoolSpec):
+			return str(spec.pool) + "/" + str(spec.spec.success)
+
+		desc = str(spec.dice) + "d" + str(spec.type)
+		if spec.bonus != 0:
+			desc += "%+d" % spec.bonus
+
+		if spec.keepFlag:
+			desc += (" kh " if spec.highFlag else " keep ") + str(spec.drop)
+		elif spec.drop != 0:
+			desc += (" dh " if spec.highFlag else " drop ") + str(spec.drop)
+
+		if spec.success is not None:
+			desc += " <= " if spec.lessThanFlag else " >= "
+			desc += str(spec.success)
+
+		if spec.explode is not None:
+			desc += " !! " if spec.explodeType == "add" else " ! "
+			desc += "<= " if spec.explodeFlag else ">= "
+			desc += str(spec.explode)
+
+		return desc
+
+	def getSpec(self):
+		"""
+		Snapshots the current roll settings as an immutable RollSpec
+		"""
+		return RollSpec(self.dice, self.type, self.bonus, self.drop, self.__keepFlag__, self.__highFlag__,
+						self.success, self.__lessThanFlag__,
+						self.explode, self.__explodeFlag__, self.explodeType)
+
+	def applySpec(self, spec):
+		"""
+		Loads the settings of a RollSpec ready to resolve
+		"""
+		(self.dice, self.type, self.bonus, self.drop, self.__keepFlag__, self.__highFlag__,
+			self.success, self.__lessThanFlag__,
+			self.explode, self.__explodeFlag__, self.explodeType) = spec
+
+	def getPlan(self, message):
+		"""
+		Looks up the compiled plan for message in the plan cache,
+		compiling it on a miss. Input that can't be parsed is
+		cached as ValueError so it isn't parsed again either.
+		"""
+		message = normalizeRoll(message)
+		key = (type(self).__name__, self.rollsLimit, self.digitLimit, message)
+
+		plan = planCache.get(key)
+		if plan is None:
+			try:
+				plan = self.compile(message)
+			except:
+				plan = ValueError
+			planCache.put(key, plan)
+
+		return plan
+
+	def compile(self, message):
+		"""
+		Turns the raw input into a RollPlan, or an error string.
+		Raises on input that can't be parsed.
+		"""
+
+		# Clean up input
+		# Removes spaces, changes minus signs to deal with negative integers
+		message = message.replace("-","+-")
+		message = message.replace("++", "+")
+
+		# Look for the x multiplier
+		multIndex = message.find("x")
+		if multIndex != -1:
+			iterations = int(message[:multIndex])
+			message = message[multIndex+1:]
 		else:
-			desc = prelude + str(CombinedResult)
+			iterations = 1
 
-		# Show dropped dice if applicable
-		if len(dropList) > 0:
-			desc += '  (dropped ' + ', '.join([str(i) for i in dropList]) + ')'
+		# Split up different rolls
+		rolls = message.split(",")
 
-		# Construct DiceResult object to return info
-		ret = DiceResult()
-		ret.total = CombinedResult
-		ret.rollList = result
-		ret.dropList = dropList
+		# Check for excessively large number of loops being required
+		if len(rolls)*iterations > self.rollsLimit:
+			return self.__overRolls__
 
-		# Set success indicators (if not an added explosion die)
-		ret.title = str(CombinedResult)
-		if not (depth > 0 and self.explodeType == "add"):
-			if success == 'Success':
-				if not self.__lessThanFlag__:
-					desc += '  \u2265 '
-				else:
-					desc += '  \u2264 '
-				desc += str(self.success
-					)
-				ret.title = success
-				ret.colour = ret.COL_HARD_SUCCESS
+		specs = []
+		for roll in rolls:
+			spec = self.compileRoll(roll)
+			if isinstance(spec, str):
+				return spec
+			specs.append(spec)
 
-			elif success == 'Failure':
-				desc += '  < ' + str(self.success)
-				ret.title = success
-				ret.colour = ret.COL_NORM_FAILURE
-				
-		# Clean up the description
-		ret.desc = desc.replace("+-", "-").replace("+ -", "- ")
-		
-		# Make sure exploded dice appear in the right order
-		retList.append(ret)
-		if depth == 0:
-			retList.reverse()
-
-			# Show added exploded dice properly
-			if self.explodeType == "add":
-				for ret in retList[1:]:
-					retList[0].desc += "\n" + ret.desc
-				retList = [retList[0]]
+		return RollPlan(iterations, tuple(specs))
 
-		return retList
+	def compileRoll(self, roll):
+		"""
+		Turns a single xdy+z roll into a RollSpec, or an error string
+		"""
+
+		# Start from the defaults
+		self.__reset__()
+
+		# Regular expression matches all possible commands
+		# Note that order does matter to avoid collision
+		# between "drop" and "d"
+
+		commands = re.split(self.__commands__, roll)
+
+		# Clean up the result a bit.
+		commands = [item for item in commands if item != " "]
+		commands = [item for item in commands if item != ""]
+		commands = [item for item in commands if item != "+"]
+
+		for n in range(len(commands)):
+			if commands[n] is "-":
+				commands[n+1] = commands[n] + commands[n+1]
+
+		commands = [item for item in commands if item != "-"]
+
+		if commands.count("d") > 1:
+			return "I can't do dice addition yet, sorry."
+
+		# Now search through commands to apply each one.
+		# xdy+z syntax
+		if "d" in commands:
+			index = commands.index("d")
+
+			# If a new roll type is set, reset values to
+			# default - surveys indicate that this is expected
+			# behaviour
+			self.__reset__()
+
+			if index != 0:
+				try:
+					self.dice = int(commands[index-1])
+				except:
+					raise ValueError
+
+			self.type = int(commands[index+1])
+			try:
+				self.bonus = int(commands[index+2])
+			except:
+				pass
+
+		# If no d, interpret a single number as the bonus
+		else:
+			try:
+				self.bonus = int(commands[0])
+			except:
+				pass
+
+		# On to more complicated problems - drop and keep
+		if "drop" in commands:
+			index = commands.index("drop")
+
+			# Check for duplicates
+			if index + 1 < len(commands):
+				if "drop" in commands[index+1:]:
+					return self.__mult__
+
+			# Check for non-default (1) drop value
+			try:
+				self.drop = int(commands[index+1])
+				if index + 2 < len(commands):
+					# Undo that if drop was in front
+					# of a "d" command
+					if commands[index+2] == "d":
+						self.drop = 1
+			except:
+				self.drop = 1
+
+		# Redo for the "keep" command
+		if "keep" in commands:
+			index = commands.index("keep")
+
+			# Check for duplicates
+			if "drop" in commands:
+				return self.__incompatible__
+
+			# Check for duplicates
+			if index + 1 < len(commands):
+				if "keep" in commands[index+1:]:
+					return self.__mult__
+
+			# Set keep andd check for non-default
+			self.__keepFlag__ = True
+			try:
+				self.drop = int(commands[index+1])
+				if index + 2 < len(commands):
+					# Undo that if keep was in front
+					# of  "d" command
+					if commands[index+2] == "d":
+						self.drop = 1
+			except:
+				self.drop = 1
+
+		# And for keep highest and drop highest
+		for command in ("kh", "dh"):
+			if command in commands:
+				index = commands.index(command)
+
+				# Check for duplicates
+				if "drop" in commands or "keep" in commands or ("kh" in commands and "dh" in commands):
+					return self.__incompatible__
+
+				# Check for duplicates
+				if index + 1 < len(commands):
+					if command in commands[index+1:]:
+						return self.__mult__
+
+				# Set flags and check for non-default
+				self.__keepFlag__ = command == "kh"
+				self.__highFlag__ = True
+				try:
+					self.drop = int(commands[index+1])
+					if index + 2 < len(commands):
+						# Undo that if it was in front
+						# of a "d" command
+						if commands[index+2] == "d":
+							self.drop = 1
+				except:
+					self.drop = 1
+
+		# Explosion
+		if "!" in commands:
+			index = commands.index("!")
+
+			# Check for compound exploding dice
+			if index + 1 < len(commands):				
+				if commands[index+1] == "!":
+					self.explodeType = "add"
+					index += 1
+				else:
+					self.explodeType = "stack"
+
+				# Check for duplicates
+				if index + 1 < len(commands):
+					if "!" in commands[index+1:]:
+						return self.__mult__
+
+			# Actually set explosion number
+			try:
+				self.explode = int(commands[index+1])
+			except:
+				self.explode = self.dice * self.type + self.bonus
+
+				# Look for comparison symbols
+				if index+1 != len(commands):
+					if ">" in commands[index+1]:
+						self.explode = int(commands[index+2])
+						if "=" not in commands[index+1]:
+							self.explode += 1
+
+					elif "<" in commands[index+1]:
+						self.explode = int(commands[index+2])
+						self.__explodeFlag__ = True
+						if "=" not in commands[index+1]:
+							self.explode -= 1
+
+		# Set success threshhold
+		# A bit different from the others to handle notation
+		# overlap with exploding dice
+		setSuccess = False
+		for i in range(len(commands)):
+			# Check for a comparison symbol
+			if ">" in commands[i] or "<" in commands[i]:
+				# Check that it's not found a !
+				if i > 0:
+					if commands[i-1] == "!":
+						continue
+
+				# Check for duplicates
+				elif setSuccess:
+					return self.__mult__
+
+				# Set success limit
+				setSuccess = True
+				self.success = int(commands[i+1])
+				# Check comparison symbol
+				if ">" in commands[i]:
+					if "=" not in commands[i]:
+						self.success += 1
+				if "<" in commands[i]:
+					self.__lessThanFlag__ = True
+					if "=" not in commands[i]:
+						self.success -= 1
+
+		# Check for bad numbers
+		# Might add more to these later.
+		# Too many digits
+		if any([abs(i[1]) > self.digitLimit for i in self.params().items() if type(i[1]) is int]):
+			return self.__overDigits__
+		# Too many rolls
+		if self.dice > self.rollsLimit:
+			return self.__overRolls__
+		# Infini-explode
+		if self.explode is not None:
+			if self.explodesForever(self.getSpec()):
+				return self.__badExplode__
+
+		return self.getSpec()
 
 	def parse(self, message=None):
 		"""
@@ -398,216 +1208,43 @@ class Roll:
 		# The whole thing is in a try and will return ValueError on failure
 		try:
 
-			# Clean up input
-			# Removes spaces, changes minus signs to deal with negative integers
-			message = message.replace("-","+-")
-			message = message.replace("++", "+")
+			# Parsing is done once per distinct input; repeated and
+			# iterated rolls reuse the cached plan
+			start = time.perf_counter()
+			self.resolveTime = None
+			plan = self.getPlan(message)
+			self.parseTime = time.perf_counter() - start
+			if plan is ValueError:
+				raise ValueError
+			elif isinstance(plan, str):
+				self.result = plan
+				return self.result
 
-			# Look for the x multiplier
-			multIndex = message.find("x")
-			if multIndex != -1:
-				iterations = int(message[:multIndex])
-				message = message[multIndex+1:]
-			else:
-				iterations = 1
+		except:
+			self.result = self.__fail__
+			return ValueError
 
-			# Split up different rolls
-			rolls = message.split(",")
+		return self.rollPlan(plan)
 
-			# Check for excessively large number of loops being required
-			if len(rolls)*iterations > self.rollsLimit:
-				self.result = self.__overRolls__
-				return self.__overRolls__
+	def rollPlan(self, plan):
+		"""
+		Rolls a compiled plan, with no parsing
+		"""
+
+		try:
+			start = time.perf_counter()
 
 			# Loop through rolls
 			self.result = []
-			for n in range(iterations):
-
-				for roll in rolls:
-
-					# Defaults are reset each iteration to ensure the same result
-					self.__reset__()
+			for n in range(plan.iterations):
 
-					# Regular expression matches all possible commands
-					# Note that order does matter to avoid collision
-					# between "drop" and "d"
+				for spec in plan.rolls:
 
-					commands = re.split(self.__commands__, roll)
-
-					# Clean up the result a bit.
-					commands = [item for item in commands if item != " "]
-					commands = [item for item in commands if item != ""]
-					commands = [item for item in commands if item != "+"]
-
-					for n in range(len(commands)):
-						if commands[n] is "-":
-							commands[n+1] = commands[n] + commands[n+1]
-
-					commands = [item for item in commands if item != "-"]
-
-					if commands.count("d") > 1:
-						self.result = "I can't do dice addition yet, sorry."
+					if self.overDeadline():
+						self.result = self.__tooSlow__
 						return self.result
 
-					# Now search through commands to apply each one.
-					# xdy+z syntax
-					if "d" in commands:
-						index = commands.index("d")
-
-						# If a new roll type is set, reset values to
-						# default - surveys indicate that this is expected
-						# behaviour
-						self.__reset__()
-
-						if index != 0:
-							try:
-								self.dice = int(commands[index-1])
-							except:
-								raise ValueError
-
-						self.type = int(commands[index+1])
-						try:
-							self.bonus = int(commands[index+2])
-						except:
-							pass
-
-					# If no d, interpret a single number as the bonus
-					else:
-						try:
-							self.bonus = int(commands[0])
-						except:
-							pass
-
-					# On to more complicated problems - drop and keep
-					if "drop" in commands:
-						index = commands.index("drop")
-
-						# Check for duplicates
-						if index + 1 < len(commands):
-							if "drop" in commands[index+1:]:
-								self.result = self.__mult__
-								return self.result
-
-						# Check for non-default (1) drop value
-						try:
-							self.drop = int(commands[index+1])
-							if index + 2 < len(commands):
-								# Undo that if drop was in front
-								# of a "d" command
-								if commands[index+2] == "d":
-									self.drop = 1
-						except:
-							self.drop = 1
-
-					# Redo for the "keep" command
-					if "keep" in commands:
-						index = commands.index("keep")
-
-						# Check for duplicates
-						if "drop" in commands:
-							self.result = self.__incompatible__
-							return self.result
-
-						# Check for duplicates
-						if index + 1 < len(commands):
-							if "keep" in commands[index+1:]:
-								self.result = self.__mult__
-								return self.result
-
-						# Set keep andd check for non-default
-						self.__keepFlag__ = True
-						try:
-							self.drop = int(commands[index+1])
-							if index + 2 < len(commands):
-								# Undo that if keep was in front
-								# of  "d" command
-								if commands[index+2] == "d":
-									self.drop = 1
-						except:
-							self.drop = 1
-
-					# Explosion
-					if "!" in commands:
-						index = commands.index("!")
-
-						# Check for compound exploding dice
-						if index + 1 < len(commands):				
-							if commands[index+1] == "!":
-								self.explodeType = "add"
-								index += 1
-							else:
-								self.explodeType = "stack"
-
-							# Check for duplicates
-							if index + 1 < len(commands):
-								if "!" in commands[index+1:]:
-									self.result = self.__mult__
-									return self.result
-
-						# Actually set explosion number
-						try:
-							self.explode = int(commands[index+1])
-						except:
-							self.explode = self.dice * self.type + self.bonus
-
-							# Look for comparison symbols
-							if index+1 != len(commands):
-								if ">" in commands[index+1]:
-									self.explode = int(commands[index+2])
-									if "=" not in commands[index+1]:
-										self.explode += 1
-
-								elif "<" in commands[index+1]:
-									self.explode = int(commands[index+2])
-									self.__explodeFlag__ = True
-									if "=" not in commands[index+1]:
-										self.explode -= 1
-
-					# Set success threshhold
-					# A bit different from the others to handle notation
-					# overlap with exploding dice
-					setSuccess = False
-					for i in range(len(commands)):
-						# Check for a comparison symbol
-						if ">" in commands[i] or "<" in commands[i]:
-							# Check that it's not found a !
-							if i > 0:
-								if commands[i-1] == "!":
-									continue
-
-							# Check for duplicates
-							elif setSuccess:
-								self.result = self.__mult__
-								return self.result
-
-							# Set success limit
-							setSuccess = True
-							self.success = int(commands[i+1])
-							# Check comparison symbol
-							if ">" in commands[i]:
-								if "=" not in commands[i]:
-									self.success += 1
-							if "<" in commands[i]:
-								self.__lessThanFlag__ = True
-								if "=" not in commands[i]:
-									self.success -= 1
-
-					# Check for bad numbers
-					# Might add more to these later.
-					# Too many digits
-					if any([abs(i[1]) > self.digitLimit for i in self.params().items() if type(i[1]) is int]):
-						self.result = self.__overDigits__
-						return self.result
-					# Too many rolls
-					if self.dice > self.rollsLimit:
-						self.result = self.__overRolls__
-						return self.result
-					#TODO: Something's wrong with this calculation.
-					# Infini-explode
-					# if self.explode is not None:
-					# 	if self.dice * self.type + self.bonus - self.explode == 1:
-					# 		self.result = self.__badExplode__
-					# 		return self.result
+					self.applySpec(spec)
 
 					# Return roll
 					res = self.resolve()
@@ -617,12 +1254,42 @@ class Roll:
 					else:
 						self.result.extend(res)
 
+			self.resolveTime = time.perf_counter() - start
 			return self.result
 
 		except:
 			self.result = self.__fail__
 			return ValueError
 
+	def display(self, plan):
+		"""
+		Writes a plan back out as an expression that compiles to it
+		"""
+		desc = ", ".join([self.describe(spec) for spec in plan.rolls])
+		if plan.iterations > 1:
+			desc = str(plan.iterations) + "x" + desc
+		return desc
+
+	def dumpPlan(self, plan):
+		"""
+		A plan as plain data that can be saved as JSON
+		"""
+		return {"version": planVersion,
+				"iterations": plan.iterations,
+				"rolls": [list(spec) for spec in plan.rolls]}
+
+	def loadPlan(self, data):
+		"""
+		Rebuilds a plan saved by dumpPlan. Returns None if it was
+		saved under another plan version or isn't a saved plan.
+		"""
+		try:
+			if data["version"] != planVersion:
+				return None
+			return RollPlan(data["iterations"], tuple([RollSpec(*spec) for spec in data["rolls"]]))
+		except (KeyError, TypeError):
+			return None
+
 	def format(self):
 		# Turns results into a nice single-message format
 
@@ -641,7 +1308,7 @@ class Roll:
 
 			# Count successes; if there's a number result between strings
 			# of successes or failures, interrupt the count with the number
-			titles = [roll.title for roll in self.result]
+			titles = [title for roll in self.result for title in roll.titles]
 			sendResult.title = ""
 
 			successes = []
@@ -679,7 +1346,7 @@ class Roll:
 				sendResult.title += str(successes.count("Success")) + " Success(es)"
 
 			# Set colour
-			if len(self.result) == 1 and self.result[0].colour != self.result[0].COL_NORM_SUCCESS:
+			if len(titles) == 1 and self.result[0].colour != DiceResult.COL_NORM_SUCCESS:
 				sendResult.colour = self.result[0].colour
 			elif "Success" in titles or "Failure" in titles:
 
@@ -690,18 +1357,18 @@ class Roll:
 				else:
 					sendResult.colour = sendResult.COL_NORM_SUCCESS
 
-			sendResult.desc = str("\n".join([roll.desc for roll in self.result]))
+			# The description is joined up (or suppressed as too long)
+			# only when it's asked for
+			sendResult.parts = self.result
 
 			if len(sendResult.title) > 256:
 				return self.__overRolls__
-			if len(sendResult.desc) >= 2048:
-				sendResult.desc = "description too long; surpressed"
 
 			return sendResult
 
 class CoC(Roll):
 
-	def __init__(self, message=None):
+	def __init__(self, message=None, rng=None):
 		# Default setup for The Call of Cthulhu-style roller which
 		# can only take a few commands
 
@@ -712,6 +1379,7 @@ class CoC(Roll):
 		self.explodeType = "stack"
 
 		self.message = message
+		self.rng = getRandom() if rng is None else rng
 
 		if self.message is not None:
 			self.parse()
@@ -722,6 +1390,7 @@ class CoC(Roll):
 		self.bonus = 0
 		self.drop = 0
 		self.__keepFlag__ = False
+		self.__highFlag__ = False
 		self.success = None
 		self.__lessThanFlag__ = True
 		self.explode = None
@@ -733,16 +1402,18 @@ class CoC(Roll):
 		Resolves a CoC-style d% roll with bonus and penalty dice
 		and a success threshold.
 		"""
-		TenResultPool = []
-		TenResultPool.append(self.rollDie(0, 9))
+		# The tens die, the ones die, then any bonus or penalty dice
+		rolls = [die - 1 for die in self.rng.dice(10, 2 + self.drop)]
+
+		TenResultPool = [rolls[0]]
 
 		TenResult = min(TenResultPool)
-		OneResult = self.rollDie(0, 9)
+		OneResult = rolls[1]
 
 		if not self.__keepFlag__:
 			# Add bonus dice
 			for i in range(self.drop):
-				TenResultPool.append(self.rollDie(0, 9))
+				TenResultPool.append(rolls[2 + i])
 				TenResult = min(TenResultPool)
 
 				# Deal with the 00 0 = 100 case
@@ -751,7 +1422,7 @@ class CoC(Roll):
 		else:
 			# OR add penalty dice
 			for i in range(self.drop):
-				TenResultPool.append(self.rollDie(0, 9))
+				TenResultPool.append(rolls[2 + i])
 				TenResult = max(TenResultPool)
 
 				# Deal with the 00 0 = 100 case
@@ -796,75 +1467,169 @@ class CoC(Roll):
 
 		return [ret]
 
-	def parse(self, message=None):
+	def resolveMany(self, spec, n, rng):
+		"""
+		Vectorized counterpart to resolve. kept holds the tens and ones
+		used for the result, dropped the other bonus or penalty tens.
+		"""
 
-		if message is None:
-			message = self.message
+		tenPool = rng.integers(0, 10, size=(n, 1 + spec.drop))
+		ones = rng.integers(0, 10, size=n)
+
+		if spec.drop == 0:
+			tens = tenPool[:, 0]
+		elif not spec.keepFlag:
+			# Bonus dice, dealing with the 00 0 = 100 case
+			tens = tenPool.min(axis=1)
+			lowestNonZero = np.where(tenPool > 0, tenPool, 10).min(axis=1)
+			hundred = (ones == 0) & (tens == 0) & (lowestNonZero < 10)
+			tens = np.where(hundred, lowestNonZero, tens)
+		else:
+			# Penalty dice, dealing with the 00 0 = 100 case
+			tens = tenPool.max(axis=1)
+			hundred = (ones == 0) & (tenPool == 0).any(axis=1)
+			tens = np.where(hundred, 0, tens)
 
-		self.result = []
+		totals = tens*10 + ones
+		totals[totals == 0] = 100
 
-		# try:
-		if True:
-			# Searches for the die syntaxes.
-			commands = [item for item in re.split(r"([bpt])", message) if item != " " and item != ""]
+		# The chosen tens die is always in the pool; drop one copy of it
+		usedIndex = np.argmax(tenPool == tens[:, None], axis=1)[:, None]
+		keepMask = np.ones(tenPool.shape, dtype=bool)
+		np.put_along_axis(keepMask, usedIndex, False, axis=1)
+		dropped = tenPool[keepMask].reshape(n, spec.drop)*10
+		kept = np.column_stack((tens*10, ones))
 
-			print(commands)
+		successes = None
+		if spec.success is not None:
+			successes = ((totals == 1) | ((totals != 100) & (totals <= spec.success))).astype(np.int64)
 
-			if "p" in commands and "b" in commands:
-				print('fail1')
-				self.result = self.__mult__
-				return self.result
+		return BatchResult(totals, kept, dropped, successes, np.zeros(n, dtype=np.int64))
 
-			for i in range(len(commands)):
-				if commands[i] == "b" or commands[i] == "p":
-					try:
-						self.drop = int(commands[i-1])
-					except:
-						self.drop = 1
-					if commands[i] == "p":
-						self.__keepFlag__ = True
-				elif commands[i] == "t":
-					try:
-						self.success = int(commands[i-1])
-					except:
-						self.result = self.__incompatible__
-						return self.result
-				else:
-					try:
-						int(commands[i])
-					except:
-						self.result = self.__fail__
-						return self.result
+	@classmethod
+	def distribution(cls, message):
+		"""
+		Works out the exact odds of a d% roll without rolling.
+		Returns a one-item list of Distribution, or an error string.
+		"""
 
-			# Check for bad numbers
-			# Might add more to these later.
-			# Too many digits
-			if any([abs(i[1]) > self.digitLimit for i in self.params().items() if type(i[1]) is int]):
-				self.result = self.__overDigits__
-				return self.result
-			# Too many rolls
-			if self.dice > self.rollsLimit:
-				self.result = self.__overRolls__
-				return self.result
+		roll = cls()
+		plan = roll.getPlan(message)
+		if plan is ValueError:
+			return roll.__fail__
+		elif isinstance(plan, str):
+			return plan
 
-			# Return roll
-			res = self.resolve()
-			if type(res) is str:
-				self.result = res
-				return self.result
+		return [percentileDistribution(plan.rolls[0])]
+
+	@classmethod
+	def tierProbabilities(cls, skill, bonus=0, penalty=0):
+		"""
+		Exact chance of each success tier against skill, as an
+		OrderedDict of the titles resolve gives them, best first.
+		Bonus and penalty dice cancel each other out.
+		"""
+
+		extra = bonus - penalty
+		if 1 <= skill <= 100 and abs(extra) <= tierDice:
+			chances = tierTable()[extra + tierDice, skill]
+		else:
+			chances = tierChances(skill, extra)
+
+		return OrderedDict(zip(tierNames, chances.tolist()))
+
+	def describe(self, spec):
+		"""
+		Writes a spec back out as an expression the parser accepts
+		"""
+
+		desc = ""
+		if spec.drop != 0:
+			desc += str(spec.drop) + ("p" if spec.keepFlag else "b")
+		if spec.success is not None:
+			desc += str(spec.success) + "t"
+		return desc
+
+	def compile(self, message):
+		"""
+		Turns the raw input into a single-roll RollPlan, or an error string
+		"""
+
+		self.__reset__()
+
+		# Searches for the die syntaxes.
+		commands = [item for item in re.split(r"([bpt])", message) if item != " " and item != ""]
+
+		logging.debug("CoC commands: " + str(commands))
+
+		if "p" in commands and "b" in commands:
+			return self.__mult__
+
+		for i in range(len(commands)):
+			if commands[i] == "b" or commands[i] == "p":
+				try:
+					self.drop = int(commands[i-1])
+				except:
+					self.drop = 1
+				if commands[i] == "p":
+					self.__keepFlag__ = True
+			elif commands[i] == "t":
+				try:
+					self.success = int(commands[i-1])
+				except:
+					return self.__incompatible__
 			else:
-				self.result.extend(res)
+				try:
+					int(commands[i])
+				except:
+					return self.__fail__
+
+		# Check for bad numbers
+		# Might add more to these later.
+		# Too many digits
+		if any([abs(i[1]) > self.digitLimit for i in self.params().items() if type(i[1]) is int]):
+			return self.__overDigits__
+		# Too many rolls
+		if self.dice > self.rollsLimit:
+			return self.__overRolls__
+
+		return RollPlan(1, (self.getSpec(),))
 
+	def parse(self, message=None):
+
+		if message is None:
+			message = self.message
+
+		self.result = []
+
+		start = time.perf_counter()
+		self.resolveTime = None
+		plan = self.getPlan(message)
+		self.parseTime = time.perf_counter() - start
+		if plan is ValueError:
+			self.result = self.__fail__
+			return ValueError
+		elif isinstance(plan, str):
+			self.result = plan
 			return self.result
 
-		# except:
-		# 	self.result = self.__fail__
-		# 	return ValueError
+		self.applySpec(plan.rolls[0])
+
+		# Return roll
+		res = self.resolve()
+		if type(res) is str:
+			self.result = res
+			return self.result
+		else:
+			self.result.extend(res)
+
+		self.resolveTime = time.perf_counter() - start - self.parseTime
+		return self.result
 
 
 class RoS(Roll):
 
-	def __init__(self, message=None):
+	def __init__(self, message=None, rng=None):
 		# Default setup for a The Riddle of Steel-style roller which
 		# can only take a few commands
 
@@ -875,6 +1640,7 @@ class RoS(Roll):
 		self.explodeType = "add"
 
 		self.message = message
+		self.rng = getRandom() if rng is None else rng
 
 		if self.message is not None:
 			self.parse()
@@ -885,98 +1651,191 @@ class RoS(Roll):
 		self.bonus = 0
 		self.drop = 0
 		self.__keepFlag__ = False
+		self.__highFlag__ = False
 		self.success = None
 		self.__lessThanFlag__ = False
 		self.explode = self.type
 		self.__explodeFlag__ = False
 		self.explodeType = "add"
 
-	def parse(self, message=None):
+	def resolveMany(self, spec, n, rng):
 		"""
-		Does its level best to make sense of the raw input
-		and turn it into a series of xdy+z rolls 
+		Vectorized counterpart to resolve. A pool is reported as its
+		number of successes, with one column of kept dice per die.
 		"""
 
-		if message is None:
-			message = self.message
+		if not isinstance(spec, PoolSpec):
+			return super().resolveMany(spec, n, rng)
 
-		# The whole thing is in a try and will return ValueError on failure
-		try:
+		res = super().resolveMany(spec.spec, n*spec.pool, rng)
+		if isinstance(res, str):
+			return res
+
+		successes = res.successes.reshape(n, spec.pool).sum(axis=1)
+		return BatchResult(successes,
+						   res.totals.reshape(n, spec.pool),
+						   np.zeros((n, 0), dtype=np.int64),
+						   successes,
+						   res.explosions.reshape(n, spec.pool).sum(axis=1))
+
+	def rollPool(self, spec, n):
+		"""
+		Rolls n dice of a pool as arrays, rolling each level of added
+		explosions for just the dice that reached it, and counts their
+		successes. Returns a PoolBatch or an error string.
+		"""
 
-			# Clean up input
-			# Removes spaces, changes minus signs to deal with negative integers
-			message = message.replace("-","+-")
-			message = message.replace("++", "+")
+		kept, dropped = self.rollDice(spec, n, self.rng)
+		totals = kept.sum(axis=1) + spec.bonus
+
+		levels = []
+		if spec.explode is not None:
+			rows = np.flatnonzero(self.isExplode(spec, totals))
+			if len(rows) > 0 and self.explodesForever(spec):
+				return self.__badExplode__
+
+			while len(rows) > 0:
+				if len(levels) >= self.explodeLimit:
+					return self.__badExplode__
+
+				levelKept, levelDropped = self.rollDice(spec, len(rows), self.rng)
+				levelTotals = levelKept.sum(axis=1) + spec.bonus
+				totals[rows] += levelTotals
+				levels.append((rows, levelKept, levelDropped, levelTotals))
+				rows = rows[self.isExplode(spec, levelTotals)]
+
+		return PoolBatch(spec, kept, dropped, totals, self.isSuccess(spec, totals), tuple(levels))
+
+	def compile(self, message):
+		"""
+		Turns the raw input into a RollPlan of pools and simple rolls,
+		or an error string. Raises on input that can't be parsed.
+		"""
+
+		# Clean up input
+		# Removes spaces, changes minus signs to deal with negative integers
+		message = message.replace("-","+-")
+		message = message.replace("++", "+")
+
+		# Look for the x multiplier
+		multIndex = message.find("x")
+		if multIndex != -1:
+			iterations = int(message[:multIndex])
+			message = message[multIndex+1:]
+		else:
+			iterations = 1
+
+		# Split up different rolls
+		rolls = message.split(",")
+
+		# Check for excessively large number of loops being required
+		if len(rolls)*iterations > self.rollsLimit:
+			return self.__overRolls__
+
+		specs = []
+		for roll in rolls:
+
+			# Pass xdy style rolls back to the parent class
+			if "/" not in roll:
+				plan = Roll().getPlan(roll)
+				if plan is ValueError:
+					raise ValueError
+				elif isinstance(plan, str):
+					return plan
+				else:
+					specs.extend(plan.rolls*plan.iterations)
 
-			# Look for the x multiplier
-			multIndex = message.find("x")
-			if multIndex != -1:
-				iterations = int(message[:multIndex])
-				message = message[multIndex+1:]
 			else:
-				iterations = 1
 
-			# Split up different rolls
-			rolls = message.split(",")
+				# Regular expression matches all possible commands
+				# Note that order does matter to avoid collision
+				# between "drop" and "d"
 
-			# Check for excessively large number of loops being required
-			if len(rolls)*iterations > self.rollsLimit:
-				return self.__overRolls__
+				commands = re.split(self.__commands__, roll)
 
-			# Loop through rolls
-			self.result = []
-			for n in range(iterations):
+				# Clean up the result a bit.
+				commands = [item for item in commands if item != " "]
+				commands = [item for item in commands if item != ""]
+				commands = [item for item in commands if item != "+"]
+
+				for n in range(len(commands)):
+					if commands[n] is "-":
+						commands[n] = commands[n] + commands[n+1]
+
+				commands = [item for item in commands if item != "-"]
 
-				# Defaults are reset each iteration to ensure the same result
+				# The Riddle of Steel notates rolls with syntax
+				# Pool / Target Number
+
+				# Set success
 				self.__reset__()
+				index = commands.index("/")
+				self.success = int(commands[index+1])
 
-				for roll in rolls:
+				pool = int(commands[index-1])
+				if abs(pool) > self.digitLimit:
+					return self.__overDigits__
 
-					# Pass xdy style rolls back to the parent class
-					if "/" not in roll:
-						res = Roll(roll).result
-						if res is ValueError:
-							return ValueError
-						elif isinstance(res, str):
-							return res
-						else:
-							self.result.extend(res)
+				specs.append(PoolSpec(pool, self.getSpec()))
 
-					else:
+		return RollPlan(iterations, tuple(specs))
 
-						# Regular expression matches all possible commands
-						# Note that order does matter to avoid collision
-						# between "drop" and "d"
+	def parse(self, message=None):
+		"""
+		Does its level best to make sense of the raw input
+		and turn it into a series of xdy+z rolls 
+		"""
+
+		if message is None:
+			message = self.message
+
+		# The whole thing is in a try and will return ValueError on failure
+		try:
 
-						commands = re.split(self.__commands__, roll)
+			start = time.perf_counter()
+			self.resolveTime = None
+			plan = self.getPlan(message)
+			self.parseTime = time.perf_counter() - start
+			if plan is ValueError:
+				raise ValueError
+			elif isinstance(plan, str):
+				self.result = plan
+				return self.result
 
-						# Clean up the result a bit.
-						commands = [item for item in commands if item != " "]
-						commands = [item for item in commands if item != ""]
-						commands = [item for item in commands if item != "+"]
+			# Roll each pool's dice for every iteration at once
+			batches = {}
+			for j, spec in enumerate(plan.rolls):
+				if isinstance(spec, PoolSpec):
+					batch = self.rollPool(spec.spec, max(spec.pool, 0)*plan.iterations)
+					if isinstance(batch, str):
+						self.result = batch
+						return self.result
+					batches[j] = batch
 
-						for n in range(len(commands)):
-							if commands[n] is "-":
-								commands[n] = commands[n] + commands[n+1]
+			# Loop through rolls
+			self.result = []
+			for n in range(plan.iterations):
 
-						commands = [item for item in commands if item != "-"]
+				for j, spec in enumerate(plan.rolls):
 
-						# The Riddle of Steel notates rolls with syntax
-						# Pool / Target Number
+					if self.overDeadline():
+						self.result = self.__tooSlow__
+						return self.result
 
-						# Set success
-						index = commands.index("/")
-						self.success = int(commands[index+1])
+					if isinstance(spec, PoolSpec):
+						pool = max(spec.pool, 0)
+						self.result.append(PoolResult(batches[j], n*pool, (n + 1)*pool))
+						continue
 
-						# Roll targets
-						for i in range(int(commands[index-1])):
-							res = self.resolve()
-							if type(res) is str:
-								self.result = res
-								return self.result
-							else:
-								self.result.extend(res)
+					self.applySpec(spec)
+					res = self.resolve()
+					if type(res) is str:
+						self.result = res
+						return self.result
+					else:
+						self.result.extend(res)
 
+			self.resolveTime = time.perf_counter() - start - self.parseTime
 			return self.result
 
 		except:
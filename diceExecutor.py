@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Dicey roll executor
+Rolls in a thread or process pool so the event loop only has Discord to
+talk to. Every roll gets a deadline, and only so many can be waiting
+at once.
+"""
+
+"""
+Imports
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import time
+from collections import namedtuple
+
+from diceClasses import *
+from diceRandom import seedRandom
+
+"""
+Global variables
+"""
+
+# "thread" rolls in a thread pool, "process" in a process pool (for
+# busy bots on interpreters with a GIL) and "inline" on the event loop
+rollMode = "thread"
+rollWorkers = 4
+
+# Seconds a roll may take, counting time spent waiting for a worker
+rollDeadline = 5
+
+# Rolls allowed to be waiting or running at once
+rollQueueLimit = 64
+
+__busy__ = "I'm rolling a lot of dice right now, try again in a moment :hourglass:"
+
+# What a worker sends back: the formatted result, the plan it rolled
+# (None if it didn't compile) and how long each stage took
+RollWork = namedtuple("RollWork", ["result", "plan", "parseTime", "resolveTime", "formatTime"])
+
+"""
+Work
+"""
+
+def rollWork(rollClass, expression=None, plan=None, deadline=None):
+	"""
+	Rolls an expression, or a compiled plan of a simple roll, and
+	formats it. Stops early with Roll.__tooSlow__ past deadline.
+	"""
+	roll = rollClass()
+	roll.deadline = deadline
+
+	if plan is not None:
+		roll.rollPlan(plan)
+	else:
+		roll.parse(expression)
+		if rollClass is Roll:
+			plan = roll.getPlan(expression)
+			if not isinstance(plan, RollPlan):
+				plan = None
+
+	start = time.perf_counter()
+	result = roll.format()
+	if not isinstance(result, str):
+		# Build the description here rather than on the event loop
+		result.desc
+	formatTime = time.perf_counter() - start
+
+	return RollWork(result, plan, roll.parseTime, roll.resolveTime, formatTime)
+
+"""
+Executor
+"""
+
+class RollExecutor:
+	"""
+	Runs rollWork in a pool made on first use. A roll that misses its
+	deadline gets Roll.__tooSlow__, and one that arrives with
+	queueLimit rolls already waiting gets __busy__.
+
+	Threads can't be stopped from outside, so a running roll checks
+	its deadline between specs and gives up by itself; one still
+	waiting for a worker is cancelled before it starts.
+	"""
+
+	def __init__(self, mode=rollMode, workers=rollWorkers, deadline=rollDeadline, queueLimit=rollQueueLimit):
+		self.mode = mode
+		self.workers = workers
+		self.deadline = deadline
+		self.queueLimit = queueLimit
+		self.pool = None
+		self.pending = 0
+
+	def getPool(self):
+		if self.pool is None:
+			if self.mode == "process":
+				# Workers get their own random streams rather than a copy of ours
+				self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=seedRandom)
+			else:
+				self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dicey-roll")
+		return self.pool
+
+	async def roll(self, rollClass, expression=None, plan=None):
+		"""
+		A RollWork for an expression or plan, or an error string
+		"""
+		deadline = time.monotonic() + self.deadline
+		if self.mode == "inline":
+			return rollWork(rollClass, expression, plan, deadline)
+
+		if self.pending >= self.queueLimit:
+			return __busy__
+
+		self.pending += 1
+		try:
+			loop = asyncio.get_running_loop()
+			if self.mode == "process":
+				future = loop.run_in_executor(self.getPool(), rollWork, rollClass, expression, plan, deadline)
+			else:
+				# Threads carry the message's context, for anything recorded under its command
+				future = loop.run_in_executor(self.getPool(), contextvars.copy_context().run,
+											  rollWork, rollClass, expression, plan, deadline)
+			return await asyncio.wait_for(future, self.deadline)
+		except asyncio.TimeoutError:
+			return Roll.__tooSlow__
+		finally:
+			self.pending -= 1
+
+	def shutdown(self):
+		if self.pool is not None:
+			self.pool.shutdown(wait=False, cancel_futures=True)
+			self.pool = None
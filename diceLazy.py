@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Dicey lazy imports
+Modules that are slow to import, or only needed by some commands, are
+loaded the first time something is looked up on them, so starting the
+bot or a worker doesn't wait on them.
+"""
+
+"""
+Imports
+"""
+import importlib
+import importlib.util
+import sys
+
+"""
+Lazy imports
+"""
+
+def lazyImport(name):
+	"""
+	The module called name, imported when first used. A module that's
+	already imported is returned as it is. The package of a submodule
+	is imported straight away, so the submodule can be set on it as
+	an import would.
+	"""
+	module = sys.modules.get(name)
+	if module is not None:
+		return module
+
+	parent, dot, child = name.rpartition(".")
+	if dot:
+		parent = importlib.import_module(parent)
+
+	spec = importlib.util.find_spec(name)
+	if spec is None:
+		raise ImportError("No module named " + name, name=name)
+
+	loader = importlib.util.LazyLoader(spec.loader)
+	spec.loader = loader
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[name] = module
+	loader.exec_module(module)
+	if dot:
+		setattr(parent, child, module)
+	return module
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Dicey metrics
+Latency histograms and counters for each command, so it's possible
+to see where the time in handling a message goes.
+"""
+
+"""
+Imports
+"""
+import json
+import os
+import time
+from array import array
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from diceRandom import poolStats
+
+"""
+Global variables
+"""
+
+# Each power of two microseconds is split into 2**(subBits - 1) buckets,
+# which keeps every value to within about 3% up to 2**maxBits us (a day)
+subBits = 6
+maxBits = 37
+
+metricsFile = "diceyMetrics.json"
+metricsText = "diceyMetrics.txt"
+metricsInterval = 60
+
+# Command the current message is being handled as; each message is
+# handled in its own task, so this is per message
+currentCommand = ContextVar("currentCommand", default="other")
+
+"""
+Histograms
+"""
+
+class Histogram:
+	"""
+	Latency histogram in microseconds with HDR-style log-linear buckets,
+	in a fixed amount of memory however many values go in
+	"""
+
+	linear = 1 << subBits
+	half = 1 << (subBits - 1)
+	size = linear + (maxBits - subBits)*half
+
+	def __init__(self):
+		self.counts = array("Q", bytes(8*self.size))
+		self.count = 0
+		self.total = 0
+		self.max = 0
+
+	def index(self, value):
+		if value < self.linear:
+			return value
+		exponent = value.bit_length() - subBits
+		return min(self.linear + (exponent - 1)*self.half + (value >> exponent) - self.half, self.size - 1)
+
+	def bounds(self, index):
+		"""
+		Lowest and highest values that land in bucket index
+		"""
+		if index < self.linear:
+			return index, index
+		exponent = (index - self.linear)//self.half + 1
+		mantissa = (index - self.linear) % self.half + self.half
+		return mantissa << exponent, ((mantissa + 1) << exponent) - 1
+
+	def record(self, microseconds):
+		value = max(int(microseconds), 0)
+		self.counts[self.index(value)] += 1
+		self.count += 1
+		self.total += value
+		self.max = max(self.max, value)
+
+	def percentile(self, p):
+		"""
+		Value below which p percent of the recorded values fall,
+		to within a bucket
+		"""
+		if self.count == 0:
+			return 0
+
+		target = max(p/100*self.count, 1)
+		running = 0
+		for i, count in enumerate(self.counts):
+			running += count
+			if running >= target:
+				low, high = self.bounds(i)
+				return min((low + high)//2, self.max)
+		return self.max
+
+	def mean(self):
+		return self.total/self.count if self.count else 0
+
+"""
+Metrics
+"""
+
+class Metrics:
+	"""
+	Latency histograms keyed by (command, stage) and counters keyed by
+	(command, name). Stages are recorded under the current command.
+	Gauges are levels by name, like how deep a queue is. Snapshots
+	also take in the dice pool counters of the random streams.
+	"""
+
+	def __init__(self):
+		self.histograms = {}
+		self.counters = {}
+		self.gauges = {}
+		self.started = time.time()
+
+	def begin(self, command):
+		"""
+		Records everything after this under command, for this message
+		"""
+		currentCommand.set(command)
+
+	def record(self, stage, seconds, command=None):
+		if command is None:
+			command = currentCommand.get()
+		histogram = self.histograms.get((command, stage))
+		if histogram is None:
+			histogram = self.histograms[(command, stage)] = Histogram()
+		histogram.record(seconds*1e6)
+
+	@contextmanager
+	def stage(self, stage):
+		"""
+		Times the block as stage of the current command
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(stage, time.perf_counter() - start)
+
+	def recordRoll(self, roll):
+		"""
+		Records the parse and resolve times of a Roll, CoC or RoS,
+		as far as it got
+		"""
+		if roll.parseTime is not None:
+			self.record("parse", roll.parseTime)
+		if roll.resolveTime is not None:
+			self.record("resolve", roll.resolveTime)
+
+	def count(self, name, command=None):
+		if command is None:
+			command = currentCommand.get()
+		self.counters[(command, name)] = self.counters.get((command, name), 0) + 1
+
+	def gauge(self, name, value):
+		"""
+		Sets a gauge, keeping the highest it's been
+		"""
+		highest = self.gauges.get(name, (0, 0))[1]
+		self.gauges[name] = (value, max(highest, value))
+
+	def snapshot(self):
+		"""
+		Everything recorded so far as a JSON-friendly dict
+		"""
+		commands = {}
+		for (command, stage), histogram in sorted(self.histograms.items()):
+			commands.setdefault(command, {"stages": {}, "counters": {}})
+			commands[command]["stages"][stage] = {"count": histogram.count,
+												  "meanUs": histogram.mean(),
+												  "p50Us": histogram.percentile(50),
+												  "p90Us": histogram.percentile(90),
+												  "p99Us": histogram.percentile(99),
+												  "maxUs": histogram.max}
+		for (command, name), count in sorted(self.counters.items()):
+			commands.setdefault(command, {"stages": {}, "counters": {}})
+			commands[command]["counters"][name] = count
+
+		gauges = {name: {"value": value, "max": highest} for name, (value, highest) in sorted(self.gauges.items())}
+
+		return {"time": time.time(), "uptime": time.time() - self.started, "commands": commands, "gauges": gauges,
+				"dicePool": poolStats()}
+
+	def report(self, snapshot=None):
+		"""
+		Plain text table of a snapshot, one line per stage or counter
+		"""
+		if snapshot is None:
+			snapshot = self.snapshot()
+
+		lines = ["Uptime " + str(int(snapshot["uptime"])) + "s",
+				 "%-10s %-8s %7s %8s %8s %8s" % ("command", "stage", "count", "p50 ms", "p99 ms", "max ms")]
+		for command, data in snapshot["commands"].items():
+			for stage, stats in data["stages"].items():
+				lines.append("%-10s %-8s %7d %8.2f %8.2f %8.2f" % (command, stage, stats["count"], stats["p50Us"]/1000,
+																 stats["p99Us"]/1000, stats["maxUs"]/1000))
+			for name, count in data["counters"].items():
+				lines.append("%-10s %-8s %7d" % (command, name, count))
+		for name, gauge in snapshot.get("gauges", {}).items():
+			lines.append("%-10s %-8s %7d max %d" % ("gauge", name, gauge["value"], gauge["max"]))
+		for name, count in snapshot.get("dicePool", {}).items():
+			lines.append("%-10s %-8s %7d" % ("dicePool", name, count))
+		return "\n".join(lines)
+
+	def write(self, jsonPath=metricsFile, textPath=metricsText):
+		"""
+		Writes a snapshot as JSON and as text, replacing the files
+		whole so a reader never sees half of one
+		"""
+		snapshot = self.snapshot()
+		for path, text in ((jsonPath, json.dumps(snapshot, indent=1)), (textPath, self.report(snapshot))):
+			with open(path + ".tmp", 'w') as metricsOut:
+				metricsOut.write(text + "\n")
+			os.replace(path + ".tmp", path)
+
+metrics = Metrics()
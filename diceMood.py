@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Dicey mood music search
+Looks up YouTube videos without blocking the event loop, through one
+shared connection pool.
+"""
+
+"""
+Imports
+"""
+import asyncio
+import re
+
+from diceLazy import lazyImport
+
+aiohttp = lazyImport("aiohttp")
+urlParse = lazyImport("urllib.parse")
+
+"""
+Global variables
+"""
+
+searchUrl = "https://www.youtube.com/results?search_query="
+videoUrl = "https://www.youtube.com"
+
+# Seconds allowed for a whole search, and searches allowed at once
+searchTimeout = 10
+searchLimit = 4
+
+linkPattern = re.compile(r"/watch\?v=[A-Za-z0-9_-]{11}")
+
+"""
+Search client
+"""
+
+def extractLinks(html):
+	"""
+	Video links in a results page, in order and without repeats
+	"""
+	return list(dict.fromkeys(linkPattern.findall(html)))
+
+class MoodSearch:
+	"""
+	Searches for videos over a session made on first use. At most
+	limit searches run at once; the rest wait their turn.
+	"""
+
+	def __init__(self, searchUrl=searchUrl, timeout=searchTimeout, limit=searchLimit):
+		self.searchUrl = searchUrl
+		self.timeout = timeout
+		self.limit = limit
+		self.session = None
+		self.semaphore = None
+
+	def getSession(self):
+		# Sessions have to be made inside the event loop
+		if self.session is None or self.session.closed:
+			self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit),
+												 timeout=aiohttp.ClientTimeout(total=self.timeout))
+			self.semaphore = asyncio.Semaphore(self.limit)
+		return self.session
+
+	async def search(self, terms):
+		"""
+		Video links for a search, in YouTube's order.
+		Raises asyncio.TimeoutError or aiohttp.ClientError on failure.
+		"""
+		session = self.getSession()
+		async with self.semaphore:
+			async with session.get(self.searchUrl + urlParse.quote(terms)) as response:
+				response.raise_for_status()
+				html = await response.text()
+		return extractLinks(html)
+
+	async def close(self):
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
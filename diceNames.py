@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Dicey name index
+Reads the name file once into per-origin and per-label indexes, and
+again only when the file changes.
+"""
+
+"""
+Imports
+"""
+import os
+import threading
+
+from diceLazy import lazyImport
+
+csv = lazyImport("csv")
+np = lazyImport("numpy")
+
+"""
+Name index
+"""
+
+class NameIndex:
+	"""
+	Names from a CSV file of name, origin, label rows. Each origin and
+	label maps to a sorted array of the rows it's on, and the rows
+	matching an (origin, label) request are worked out once and kept
+	until the file changes.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.mtime = None
+		self.lock = threading.Lock()
+		self.clear()
+
+	def clear(self):
+		self.names = []
+		self.origins = {}
+		self.labels = {}
+		self.originList = []
+		self.labelList = []
+		self.matches = {}
+
+	def refresh(self):
+		"""
+		Reloads the file if it changed since it was last read.
+		Returns False if there's no file to read.
+		"""
+		try:
+			mtime = os.stat(self.path).st_mtime_ns
+		except OSError:
+			return False
+
+		if mtime != self.mtime:
+			with self.lock:
+				if mtime != self.mtime:
+					try:
+						self.load()
+					except IOError:
+						return False
+					self.mtime = mtime
+		return True
+
+	def load(self):
+		names = []
+		origins = {}
+		labels = {}
+		with open(self.path) as csvfile:
+			reader = csv.reader(csvfile)
+			for row, line in enumerate(reader):
+				names.append(line[0])
+				origins.setdefault(line[1], []).append(row)
+				labels.setdefault(line[2], []).append(row)
+
+		self.clear()
+		self.names = names
+		self.origins = {origin: np.array(rows) for origin, rows in origins.items()}
+		self.labels = {label: np.array(rows) for label, rows in labels.items()}
+		self.originList = sorted(origins)
+		self.labelList = sorted(labels)
+
+	def rows(self, origin, label):
+		"""
+		Rows with the given origin and label; an empty origin
+		matches any, and the label "name" matches male or female
+		"""
+		key = (origin, label)
+		rows = self.matches.get(key)
+		if rows is None:
+			if label == "name":
+				rows = np.union1d(self.labels.get("male", []), self.labels.get("female", [])).astype(int)
+			else:
+				rows = self.labels.get(label, np.array([], dtype=int))
+			if origin != "":
+				rows = np.intersect1d(rows, self.origins.get(origin, []), assume_unique=True).astype(int)
+			self.matches[key] = rows
+		return rows
+
+	def draw(self, origin, label, count, rng):
+		"""
+		Up to count different matching names, picked at random
+		from a DiceRandom stream
+		"""
+		with self.lock:
+			rows = self.rows(origin, label)
+			picks = rng.generator.choice(len(rows), size=min(count, len(rows)), replace=False)
+			return [self.names[rows[pick]] for pick in picks]
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Dicey exact probability calculations
+Works on the compiled roll specs from diceClasses.
+"""
+
+"""
+Imports
+"""
+from collections import namedtuple
+from functools import lru_cache
+from math import comb
+
+from diceLazy import lazyImport
+
+np = lazyImport("numpy")
+
+"""
+Global variables
+"""
+
+# Explosion chains are followed until reaching the next level is
+# less likely than this; anything beyond it can't show up in a float
+pruneLimit = 1e-16
+
+# Largest number of partial-selection steps done for drop/keep
+complexityLimit = 500000
+
+# Products bigger than this are convolved with an FFT
+fftLimit = 1000000
+
+# Most outcomes a sum of dice is worked out over
+pmfLimit = 1000000
+
+# Most work put into an explosion chain, as the outcomes of one level
+# times the square of the levels followed
+chainLimit = 10000000
+
+# Call of Cthulhu success tiers, best first, as CoC titles its results
+tierNames = ("Critical Success!", "Extreme Success!", "Hard Success!", "Success", "Failure", "Critical Failure!")
+
+# Bonus or penalty dice covered by the precomputed tier table
+tierDice = 5
+
+# Probability of each total and of each number of successes for one roll.
+# unbounded is the chance the roll explodes past the explosion limit.
+# A stacking explosion shows each level on its own, so its totals are
+# those of one level and levels is how many it shows on average; for
+# anything else levels is None.
+Distribution = namedtuple("Distribution", ["totals", "successes", "unbounded", "levels"], defaults=(None,))
+
+"""
+Mass functions
+A mass function is kept as (offset, array), where array[i] is the
+probability of the value offset + i.
+"""
+
+def convolve(a, b):
+	"""
+	Convolves two probability arrays, by FFT if they're large
+	"""
+	if len(a)*len(b) < fftLimit:
+		return np.convolve(a, b)
+
+	n = len(a) + len(b) - 1
+	size = 1 << (n - 1).bit_length()
+	out = np.fft.irfft(np.fft.rfft(a, size)*np.fft.rfft(b, size), size)[:n]
+	return np.clip(out, 0, None)
+
+def addPmf(p, q):
+	"""
+	Sum of two independent variables
+	"""
+	return (p[0] + q[0], convolve(p[1], q[1]))
+
+def mixPmf(p, q):
+	"""
+	Adds the mass of q to the mass of p, lining up the offsets
+	"""
+	if len(p[1]) == 0:
+		return q
+	if len(q[1]) == 0:
+		return p
+
+	low = min(p[0], q[0])
+	high = max(p[0] + len(p[1]), q[0] + len(q[1]))
+	out = np.zeros(high - low)
+	out[p[0] - low:p[0] - low + len(p[1])] += p[1]
+	out[q[0] - low:q[0] - low + len(q[1])] += q[1]
+	return (low, out)
+
+def splitPmf(p, mask):
+	"""
+	Splits p into the mass where mask holds and the rest
+	"""
+	return (p[0], np.where(mask, p[1], 0.0)), (p[0], np.where(mask, 0.0, p[1]))
+
+def pmfDict(p):
+	"""
+	Turns a mass function into a {value: probability} dict
+	"""
+	return {p[0] + i: float(prob) for i, prob in enumerate(p[1]) if prob > 0}
+
+def dicePmf(dice, type):
+	"""
+	Sum of dice rolls of a type-sided die, by repeated squaring so
+	it takes a handful of convolutions however many dice there are
+	"""
+	if type == 0:
+		return (0, np.ones(1))
+	if dice*type > pmfLimit:
+		raise OverflowError
+
+	die = (1, np.full(type, 1.0/type))
+	total = (0, np.ones(1))
+	while dice > 0:
+		if dice & 1:
+			total = addPmf(total, die)
+		dice >>= 1
+		if dice > 0:
+			die = addPmf(die, die)
+	return total
+
+def selectionPmf(dice, type, low, high):
+	"""
+	Sum of the dice in places low to high (exclusive) once the
+	roll is sorted from lowest to highest.
+
+	Works up through the faces, choosing how many of the remaining
+	dice land on each face; only the dice landing in the kept places
+	add to the sum.
+	"""
+	if type == 0:
+		return (0, np.ones(1))
+	if type*(dice + 1)*(dice + 2)//2 > complexityLimit:
+		raise OverflowError
+
+	size = (high - low)*type + 1
+	weights = np.zeros((dice + 1, size))
+	weights[0][0] = 1.0
+	face = 1.0/type
+
+	for value in range(1, type + 1):
+		new = np.zeros((dice + 1, size))
+		for placed in range(dice + 1):
+			if not weights[placed].any():
+				continue
+
+			# Every die left has to land on the last face
+			first = dice - placed if value == type else 0
+
+			for count in range(first, dice - placed + 1):
+				overlap = max(0, min(placed + count, high) - max(placed, low))
+				shift = value*overlap
+				chance = comb(dice - placed, count)*face**count
+				new[placed + count][shift:] += weights[placed][:size - shift]*chance
+		weights = new
+
+	return (0, weights[dice])
+
+def levelPmf(spec):
+	"""
+	Total of a single xdy+z roll with drop, keep, kh or dh, before explosions
+	"""
+	if spec.type < 0:
+		raise ValueError
+
+	if not spec.keepFlag:
+		if spec.drop > spec.dice:
+			raise ValueError
+		dropped = spec.drop
+	else:
+		dropped = max(spec.dice - spec.drop, 0)
+
+	# keep and dh drop from the top, drop and kh from the bottom
+	if spec.keepFlag != spec.highFlag:
+		low, high = 0, spec.dice - dropped
+	else:
+		low, high = dropped, spec.dice
+
+	if low == 0 and high == spec.dice:
+		total = dicePmf(spec.dice, spec.type)
+	else:
+		total = selectionPmf(spec.dice, spec.type, low, high)
+
+	return (total[0] + spec.bonus, total[1])
+
+def chainPmf(explode, stop, depth):
+	"""
+	Sum over an explosion chain, where explode and stop hold the mass
+	of each level's contribution when it does or doesn't explode again.
+	depth is the number of explosions allowed.
+	"""
+	explodeChance = float(explode[1].sum())
+	if 0 < explodeChance < 1:
+		depth = min(depth, int(np.log(pruneLimit)/np.log(explodeChance)) + 1)
+	width = max(len(explode[1]), len(stop[1]))
+	if width*(depth + 1)**2 > chainLimit:
+		raise OverflowError
+
+	# Work back up from the deepest level
+	chain = stop
+	for level in range(depth):
+		chain = mixPmf(stop, addPmf(explode, chain))
+	return chain
+
+def successMask(spec, p):
+	values = np.arange(p[0], p[0] + len(p[1]))
+	if not spec.lessThanFlag:
+		return values >= spec.success
+	return values <= spec.success
+
+def explodeMask(spec, p):
+	values = np.arange(p[0], p[0] + len(p[1]))
+	if not spec.explodeFlag:
+		return values >= spec.explode
+	return values <= spec.explode
+
+def indicatorPmf(p, mask):
+	"""
+	Mass of p as a 0/1 variable that's 1 where mask holds
+	"""
+	return (0, np.array([p[1][~mask].sum(), p[1][mask].sum()]))
+
+@lru_cache(maxsize=256)
+def explodeChance(spec):
+	"""
+	Chance of one roll of spec exploding, memoized per spec
+	"""
+	level = levelPmf(spec)
+	return float(level[1][explodeMask(spec, level)].sum())
+
+@lru_cache(maxsize=256)
+def specDistribution(spec, explodeLimit):
+	"""
+	Exact Distribution of a RollSpec or PoolSpec, memoized per spec.
+	Raises ValueError for specs that can't be rolled and OverflowError
+	for ones with too many outcomes to work out.
+	"""
+
+	# Riddle of Steel pools count successes over independent dice
+	if hasattr(spec, "pool"):
+		single = specDistribution(spec.spec, explodeLimit)
+		successes = (0, np.ones(1))
+		die = (0, np.array([single.successes.get(0, 0.0), single.successes.get(1, 0.0)]))
+		for i in range(spec.pool):
+			successes = addPmf(successes, die)
+		successes = pmfDict(successes)
+		unbounded = 1 - (1 - single.unbounded)**spec.pool
+		return Distribution(successes, successes, unbounded)
+
+	level = levelPmf(spec)
+
+	levels = None
+	if spec.explode is None:
+		totals = level
+		unbounded = 0.0
+	else:
+		explode, stop = splitPmf(level, explodeMask(spec, level))
+		chance = float(explode[1].sum())
+		unbounded = chance**(explodeLimit + 1)
+		if spec.explodeType == "stack":
+			totals = level
+			levels = (1 - unbounded)/(1 - chance) if chance < 1 else explodeLimit + 1.0
+		else:
+			totals = chainPmf(explode, stop, explodeLimit)
+
+	successes = None
+	if spec.success is not None:
+		if spec.explode is not None and spec.explodeType == "stack":
+			# Each stacked level is a separate success check
+			mask = successMask(spec, level)
+			explode, stop = splitPmf(level, explodeMask(spec, level))
+			successes = chainPmf(indicatorPmf(explode, mask), indicatorPmf(stop, mask), explodeLimit)
+			successes = pmfDict(successes)
+		else:
+			successes = pmfDict(indicatorPmf(totals, successMask(spec, totals)))
+
+	return Distribution(pmfDict(totals), successes, unbounded, levels)
+
+@lru_cache(maxsize=256)
+def percentileTotals(drop, penalty):
+	"""
+	Chance of each total of a Call of Cthulhu d% roll with drop bonus
+	(or penalty) tens dice, as an array indexed by total
+	"""
+	pool = 1 + drop
+	tens = np.arange(10)
+	totals = np.zeros(101)
+
+	for ones in range(10):
+		if drop == 0:
+			chance = np.full(10, 0.1)
+		elif not penalty:
+			# Lowest tens die, or the lowest non-zero one for 00 + 0
+			if ones != 0:
+				chance = ((10 - tens)/10)**pool - ((9 - tens)/10)**pool
+			else:
+				chance = ((11 - tens)/10)**pool - ((10 - tens)/10)**pool
+				chance[0] = 0.1**pool
+		else:
+			# Highest tens die, or 00 if there's one and the ones are 0
+			if ones != 0:
+				chance = ((tens + 1)/10)**pool - (tens/10)**pool
+			else:
+				chance = (tens/10)**pool - ((tens - 1)/10)**pool
+				chance[0] = 1 - 0.9**pool
+
+		values = tens*10 + ones
+		values[values == 0] = 100
+		totals[values] += chance/10
+
+	totals.flags.writeable = False
+	return totals
+
+@lru_cache(maxsize=256)
+def percentileDistribution(spec):
+	"""
+	Exact Distribution of a Call of Cthulhu d% roll, memoized per spec,
+	where drop is the number of bonus (or with keepFlag, penalty) tens
+	dice. A success is anything up to the threshold, bar a 100.
+	"""
+	totals = (0, percentileTotals(spec.drop, spec.keepFlag))
+	successes = None
+	if spec.success is not None:
+		values = np.arange(101)
+		successes = pmfDict(indicatorPmf(totals, (values == 1) | ((values != 100) & (values <= spec.success))))
+
+	return Distribution(pmfDict(totals), successes, 0.0)
+
+def tierChances(skill, extra):
+	"""
+	Chance of each of tierNames against skill, with extra bonus dice
+	(or -extra penalty dice), worked out from the totals
+	"""
+	totals = percentileTotals(abs(extra), extra < 0)
+	cumulative = np.cumsum(totals)
+
+	# Totals from 2 up to a bound, short of 100
+	def upTo(bound):
+		return cumulative[min(max(int(bound), 1), 99)] - cumulative[1]
+
+	extreme = upTo(skill/5)
+	hard = upTo(skill/2)
+	success = upTo(skill)
+	return np.array([totals[1], extreme, hard - extreme, success - hard, cumulative[99] - cumulative[1] - success, totals[100]])
+
+@lru_cache(maxsize=None)
+def tierTable():
+	"""
+	tierChances for every skill from 1 to 100 and up to tierDice bonus
+	or penalty dice, indexed by [extra + tierDice, skill]
+	"""
+	table = np.zeros((2*tierDice + 1, 101, len(tierNames)))
+	for extra in range(-tierDice, tierDice + 1):
+		for skill in range(1, 101):
+			table[extra + tierDice, skill] = tierChances(skill, extra)
+	table.flags.writeable = False
+	return table
+
+def summarize(totals):
+	"""
+	Mean, standard deviation and median of a {value: probability} dict
+	"""
+	mass = sum(totals.values())
+	mean = sum(value*prob for value, prob in totals.items())/mass
+	variance = sum((value - mean)**2*prob for value, prob in totals.items())/mass
+
+	running = 0.0
+	median = None
+	for value in sorted(totals):
+		running += totals[value]/mass
+		if running >= 0.5:
+			median = value
+			break
+
+	return mean, variance**0.5, median
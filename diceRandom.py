@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Dicey random number source
+One place for every random draw the bot makes, so rolls can be
+seeded for tests and replays and split into independent streams
+for worker threads and processes.
+"""
+
+"""
+Imports
+"""
+import threading
+import weakref
+
+from diceLazy import lazyImport
+
+np = lazyImport("numpy")
+
+"""
+Global variables
+"""
+
+bufferSize = 4096
+
+# Dice with up to poolLimit sides are dealt out of a pool of poolSize
+# pre-rolled dice per size; bigger dice and bigger draws skip the pool
+poolLimit = 100
+poolSize = 4096
+
+"""
+Random streams
+"""
+
+class DiceRandom:
+	"""
+	A stream of random numbers backed by NumPy's PCG64.
+
+	Single draws come out of a buffered block of floats to skip the
+	per-call overhead, and whole handfuls of dice come out of a pool
+	of pre-rolled dice for each size; vectorized draws go straight to
+	the generator.
+	Every stream has a concrete seed, and stream n of a seed is the
+	seed's generator jumped n times, so streams never overlap and can
+	be rebuilt anywhere from (seed, n).
+	"""
+
+	def __init__(self, seed=None, stream=0, bufferSize=bufferSize):
+		if seed is None:
+			seed = np.random.SeedSequence().entropy
+
+		self.seed = seed
+		self.streamIndex = stream
+		self.bufferSize = bufferSize
+
+		bitGenerator = np.random.PCG64(seed)
+		if stream != 0:
+			bitGenerator = bitGenerator.jumped(stream)
+		self.generator = np.random.Generator(bitGenerator)
+
+		self.buffer = []
+		self.index = 0
+
+		# {sides: [dice, position]}, refilled as they run dry. hits
+		# counts draws served without a refill, direct ones that
+		# skipped the pool.
+		self.pools = {}
+		self.hits = 0
+		self.refills = 0
+		self.direct = 0
+
+	def stream(self, n):
+		"""
+		Independent stream n of this stream's seed
+		"""
+		return DiceRandom(self.seed, n, self.bufferSize)
+
+	def spawn(self, n):
+		"""
+		n independent streams (1 to n) of this stream's seed
+		"""
+		return [self.stream(i + 1) for i in range(n)]
+
+	def random(self):
+		"""
+		A float in [0, 1)
+		"""
+		if self.index >= len(self.buffer):
+			self.buffer = self.generator.random(self.bufferSize).tolist()
+			self.index = 0
+
+		self.index += 1
+		return self.buffer[self.index - 1]
+
+	def randint(self, minimum, maximum):
+		"""
+		An integer from minimum to maximum inclusive
+		"""
+		if maximum < minimum:
+			raise ValueError
+		return minimum + int(self.random()*(maximum - minimum + 1))
+
+	def choice(self, items):
+		"""
+		A random item of a non-empty sequence
+		"""
+		if len(items) == 0:
+			raise IndexError
+		return items[int(self.random()*len(items))]
+
+	def dice(self, sides, count):
+		"""
+		A list of count rolls of a die with sides sides
+		"""
+		if sides > poolLimit or count > poolSize:
+			self.direct += 1
+			return self.generator.integers(1, sides, size=count, endpoint=True).tolist()
+
+		pool = self.pools.get(sides)
+		if pool is None:
+			pool = self.pools[sides] = [[], 0]
+
+		if pool[1] + count > len(pool[0]):
+			pool[0] = pool[0][pool[1]:] + self.generator.integers(1, sides, size=poolSize, endpoint=True).tolist()
+			pool[1] = 0
+			self.refills += 1
+		else:
+			self.hits += 1
+
+		pool[1] += count
+		return pool[0][pool[1] - count:pool[1]]
+
+	# Vectorized draws, with numpy.random.Generator's signatures
+	def integers(self, low, high=None, size=None, endpoint=False):
+		return self.generator.integers(low, high, size=size, endpoint=endpoint)
+
+	def geometric(self, p, size=None):
+		return self.generator.geometric(p, size=size)
+
+"""
+Shared streams
+Each thread gets its own stream of the root seed the first time it
+asks, numbered in the order threads ask; the first caller gets stream
+0. Reseeding hands every thread a fresh stream of the new seed. The
+root stream is made on first use, so importing this doesn't load NumPy.
+"""
+
+root = None
+generation = 0
+nextStream = 0
+streamLock = threading.Lock()
+local = threading.local()
+streams = weakref.WeakSet()
+
+def getRandom():
+	"""
+	The calling thread's stream
+	"""
+	global root, nextStream
+
+	if getattr(local, "generation", None) != generation:
+		with streamLock:
+			if root is None:
+				root = DiceRandom()
+			local.rng = root.stream(nextStream)
+			streams.add(local.rng)
+			local.generation = generation
+			nextStream += 1
+
+	return local.rng
+
+def seedRandom(seed=None):
+	"""
+	Restarts every stream from seed, for reproducible rolls.
+	None picks a fresh random seed.
+	"""
+	global root, generation, nextStream
+
+	with streamLock:
+		root = DiceRandom(seed)
+		generation += 1
+		nextStream = 0
+
+def poolStats():
+	"""
+	Dice pool counters summed over the threads' streams
+	"""
+	with streamLock:
+		live = list(streams)
+
+	return {"hits": sum(rng.hits for rng in live),
+			"refills": sum(rng.refills for rng in live),
+			"direct": sum(rng.direct for rng in live)}
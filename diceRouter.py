@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Dicey command router
+Finds the command a message starts with by walking a trie of command
+names, so routing takes one pass over the message however many
+commands there are.
+"""
+
+"""
+Imports
+"""
+import time
+from collections import namedtuple
+
+"""
+Global variables
+"""
+
+# Calls allowed per user, as (calls, seconds), for commands of each
+# cost class that don't give their own rate limit
+costLimits = {"light": None,
+			  "roll": None,
+			  "io": (5, 10),
+			  "cpu": (3, 10)}
+
+# Rate limit buckets kept before the full ones are thrown away
+bucketLimit = 10000
+
+# A registered command. name is without the prefix; an exact command
+# only matches the whole message. cost is "light", "roll", "io" or
+# "cpu", and executor is None to run the handler on the event loop or
+# "pool" to run it in a worker thread.
+Command = namedtuple("Command", ["name", "handler", "exact", "cost", "executor", "rateLimit"])
+
+"""
+Rate limits
+"""
+
+class TokenBucket:
+	"""
+	Allows capacity calls at once, refilling at capacity per seconds
+	"""
+
+	def __init__(self, capacity, seconds):
+		self.capacity = capacity
+		self.rate = capacity/seconds
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+		self.updated = now
+
+	def take(self):
+		"""
+		Takes a token and returns True, or returns False if there isn't one
+		"""
+		self.refill()
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return True
+		return False
+
+	def wait(self):
+		"""
+		Seconds until a token is free
+		"""
+		self.refill()
+		return max(0, (1 - self.tokens)/self.rate)
+
+	def full(self):
+		self.refill()
+		return self.tokens >= self.capacity
+
+"""
+Router
+"""
+
+class Router:
+	"""
+	Commands in a trie under prefix. Names are matched without regard
+	to case, and the longest name a message starts with wins, so
+	$saved is never mistaken for $save or $nametypes for $name.
+	"""
+
+	def __init__(self, prefix):
+		self.prefix = prefix
+		self.root = {}
+		self.commands = {}
+		self.buckets = {}
+
+	def add(self, name, handler, exact=False, cost="light", executor=None, rateLimit=None):
+		"""
+		Registers handler under name, which starts with the prefix
+		"""
+		if not name.startswith(self.prefix):
+			raise ValueError("Command " + name + " doesn't start with " + self.prefix)
+		name = name[len(self.prefix):].lower()
+
+		if rateLimit is None:
+			rateLimit = costLimits[cost]
+		command = Command(name, handler, exact, cost, executor, rateLimit)
+
+		node = self.root
+		for char in name:
+			node = node.setdefault(char, {})
+		# Characters are the keys of a node; None holds the command ending there
+		node[None] = command
+		self.commands[name] = command
+		return command
+
+	def command(self, *names, **metadata):
+		"""
+		Decorator registering a handler under each of names
+		"""
+		def register(handler):
+			for name in names:
+				self.add(name, handler, **metadata)
+			return handler
+		return register
+
+	def route(self, text):
+		"""
+		The command text starts with and the rest of text after its
+		name, or None and text if it doesn't start with one
+		"""
+		if text[:len(self.prefix)].lower() != self.prefix:
+			return None, text
+
+		found = None
+		end = 0
+		node = self.root
+		i = len(self.prefix)
+		while node is not None:
+			command = node.get(None)
+			if command is not None and (not command.exact or i == len(text)):
+				found = command
+				end = i
+			if i == len(text):
+				break
+			node = node.get(text[i].lower())
+			i += 1
+
+		if found is None:
+			return None, text
+		return found, text[end:]
+
+	def allow(self, command, user):
+		"""
+		Whether user may call command now, under its rate limit
+		"""
+		if command.rateLimit is None:
+			return True
+
+		if len(self.buckets) > bucketLimit:
+			self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.full()}
+
+		bucket = self.buckets.get((command.name, user))
+		if bucket is None:
+			bucket = self.buckets[(command.name, user)] = TokenBucket(*command.rateLimit)
+		return bucket.take()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Dicey send queue
+Sends replies through a queue per channel, in order, paced to stay
+under Discord's rate limits. Roll results that pile up in a busy
+channel go out together as one message.
+"""
+
+"""
+Imports
+"""
+import asyncio
+import time
+from collections import deque
+
+from diceMetrics import currentCommand
+from diceMetrics import metrics
+from diceRouter import TokenBucket
+
+"""
+Global variables
+"""
+
+# Messages allowed per channel, as (messages, seconds), and across
+# every channel per second
+channelLimit = (5, 5)
+globalLimit = 50
+
+# Seconds a roll result in a busy channel waits for others to join it
+coalesceWindow = 0.25
+
+# What Discord allows in one message
+embedLimit = 10
+contentLimit = 2000
+
+# Channel rate limit buckets kept before the full ones are thrown away
+bucketLimit = 10000
+
+"""
+Send queue
+"""
+
+class Outgoing:
+	"""
+	A message waiting to be sent; future gets the sent message
+	"""
+
+	__slots__ = ("content", "embeds", "coalesce", "command", "queued", "future")
+
+	def __init__(self, content, embed, coalesce):
+		self.content = content
+		self.embeds = [] if embed is None else [embed]
+		self.coalesce = coalesce
+		self.command = currentCommand.get()
+		self.queued = time.monotonic()
+		self.future = asyncio.get_running_loop().create_future()
+
+class SendQueue:
+	"""
+	Queues of outgoing messages by channel, each drained in order by
+	its own task while it has anything in it. A channel that has sent
+	recently is busy: the first roll result waiting in it gives others
+	the window to arrive, and the ones at the front of the queue are
+	then sent as one message with an embed each.
+	"""
+
+	def __init__(self, channelLimit=channelLimit, globalLimit=globalLimit, window=coalesceWindow):
+		self.channelLimit = channelLimit
+		self.window = window
+		self.globalBucket = TokenBucket(globalLimit, 1)
+		self.buckets = {}
+		self.queues = {}
+		self.tasks = {}
+		self.depth = 0
+
+	async def send(self, channel, content=None, embed=None, coalesce=False):
+		"""
+		Queues a message and returns it once it's sent, as part
+		of a bigger one if it was coalesced
+		"""
+		item = Outgoing(content, embed, coalesce)
+		self.queues.setdefault(channel.id, deque()).append(item)
+		self.setDepth(self.depth + 1)
+
+		if channel.id not in self.tasks:
+			self.tasks[channel.id] = asyncio.get_running_loop().create_task(self.drain(channel))
+		return await item.future
+
+	def setDepth(self, depth):
+		self.depth = depth
+		metrics.gauge("sendQueue", depth)
+		metrics.gauge("sendChannels", len(self.queues))
+
+	def getBucket(self, channel):
+		bucket = self.buckets.get(channel.id)
+		if bucket is None:
+			if len(self.buckets) > bucketLimit:
+				self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.full()}
+			bucket = self.buckets[channel.id] = TokenBucket(*self.channelLimit)
+		return bucket
+
+	def batch(self, queue):
+		"""
+		Takes the next message off queue, along with the roll
+		results behind it if it's one
+		"""
+		first = queue.popleft()
+		batch = [first]
+		if not first.coalesce:
+			return batch
+
+		length = len(first.content or "")
+		embeds = len(first.embeds)
+		while queue and queue[0].coalesce:
+			item = queue[0]
+			length += len(item.content or "") + 1
+			embeds += len(item.embeds)
+			if length > contentLimit or embeds > embedLimit:
+				break
+			batch.append(queue.popleft())
+		return batch
+
+	async def drain(self, channel):
+		queue = self.queues[channel.id]
+		bucket = self.getBucket(channel)
+		try:
+			while queue:
+				if queue[0].coalesce and not bucket.full():
+					await asyncio.sleep(max(0, queue[0].queued + self.window - time.monotonic()))
+
+				while not bucket.take():
+					await asyncio.sleep(bucket.wait())
+				while not self.globalBucket.take():
+					await asyncio.sleep(self.globalBucket.wait())
+
+				batch = self.batch(queue)
+				self.setDepth(self.depth - len(batch))
+				now = time.monotonic()
+				for item in batch:
+					metrics.record("queued", now - item.queued, item.command)
+				if len(batch) > 1:
+					metrics.count("coalesced", batch[0].command)
+
+				content = "\n".join([item.content for item in batch if item.content]) or None
+				embeds = [embed for item in batch for embed in item.embeds]
+				try:
+					if len(embeds) > 1:
+						sent = await channel.send(content, embeds=embeds)
+					elif embeds:
+						sent = await channel.send(content, embed=embeds[0])
+					else:
+						sent = await channel.send(content)
+				except Exception as e:
+					for item in batch:
+						if not item.future.done():
+							item.future.set_exception(e)
+				else:
+					for item in batch:
+						if not item.future.done():
+							item.future.set_result(sent)
+		finally:
+			del self.tasks[channel.id]
+			if not queue:
+				del self.queues[channel.id]
+				metrics.gauge("sendChannels", len(self.queues))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Dicey Monte Carlo simulation
+Rolls an expression many times over with the vectorized roll engine
+and reports summary statistics instead of every roll.
+"""
+
+"""
+Imports
+"""
+import concurrent.futures
+import os
+import threading
+import time
+from collections import namedtuple
+
+from diceClasses import *
+from diceLazy import lazyImport
+from diceOdds import explodeChance
+from diceRandom import DiceRandom
+
+np = lazyImport("numpy")
+
+"""
+Global variables
+"""
+
+simLimit = 10**7
+chunkSize = 50000
+histogramBins = 10
+
+# Dice a simulation may roll across all its trials, counting the
+# explosion levels each roll makes on average, and seconds it may take.
+# Chunks roll at most chunkWork dice, so the deadline is checked often.
+workLimit = 5*10**8
+chunkWork = 10**7
+simDeadline = 30
+
+__overTrials__ = "Sorry... I'll only simulate up to " + str(simLimit) + " trials."
+__overWork__ = "That's a lot of dice! Try fewer trials or a smaller roll."
+
+# Trial counts are summed into {value: count} tallies, so chunks from
+# different workers combine exactly. successRate is the share of trials
+# with at least one success and is None if nothing had a threshold.
+SimResult = namedtuple("SimResult", ["trials", "mean", "sd", "percentiles",
+									 "successRate", "meanSuccesses", "histogram"])
+
+# Simulations run on worker threads, so the pool is made under poolLock
+pool = None
+poolWorkers = None
+poolLock = threading.Lock()
+
+"""
+Simulation functions
+"""
+
+def getPool(workers):
+	"""
+	Process pool shared between simulations, made on first use
+	"""
+	global pool, poolWorkers
+	with poolLock:
+		if pool is None or poolWorkers != workers:
+			if pool is not None:
+				pool.shutdown()
+			pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+			poolWorkers = workers
+		return pool
+
+def planWork(plan, explodeLimit=Roll.explodeLimit):
+	"""
+	Dice one trial of a RollPlan rolls. Exploding rolls count the
+	levels they make on average, or every level they're allowed if
+	there's no working out how often they explode.
+	"""
+	work = 0
+	for spec in plan.rolls:
+		pool = 1
+		if isinstance(spec, PoolSpec):
+			pool, spec = spec.pool, spec.spec
+
+		levels = 1
+		if spec.explode is not None:
+			try:
+				chance = explodeChance(spec)
+			except (OverflowError, ValueError):
+				chance = 1
+			levels = explodeLimit if chance >= 1 else min(1/(1 - chance), explodeLimit)
+
+		work += pool*max(spec.dice, 1)*levels
+	return work*plan.iterations
+
+def simulateChunk(rollClass, message, n, rng):
+	"""
+	Rolls n trials with their own DiceRandom stream and tallies them.
+	Returns (values, counts, successful trials, total successes,
+	whether anything had a threshold), or an error string.
+	"""
+	results = rollClass.rollMany(message, n, rng)
+	if isinstance(results, str):
+		return results
+
+	scores = np.zeros(n, dtype=np.int64)
+	successes = np.zeros(n, dtype=np.int64)
+	hasThreshold = False
+	for res in results:
+		scores += res.totals
+		if res.successes is not None:
+			successes += res.successes
+			hasThreshold = True
+
+	values, counts = np.unique(scores, return_counts=True)
+	return values, counts, int((successes > 0).sum()), int(successes.sum()), hasThreshold
+
+def simulate(message, trials, rollClass=Roll, workers=None, seed=None):
+	"""
+	Runs trials independent evaluations of message with rollClass
+	(Roll, CoC or RoS) and returns a SimResult, or an error string.
+	Each trial scores the sum of its roll totals; a pool scores its
+	successes. Chunks run in a process pool of workers processes
+	(default: one per core), each with an independent random stream
+	of seed.
+	"""
+
+	if trials > simLimit:
+		return __overTrials__
+	if trials < 1:
+		return rollClass.__fail__
+
+	roll = rollClass()
+	plan = roll.getPlan(message)
+	if plan is ValueError:
+		return roll.__fail__
+	elif isinstance(plan, str):
+		return plan
+	try:
+		work = planWork(plan, roll.explodeLimit)
+	except:
+		return roll.__fail__
+	if trials*work > workLimit:
+		return __overWork__
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+
+	size = int(max(min(chunkSize, chunkWork/max(work, 1)), 1))
+	sizes = [size]*(trials//size)
+	if trials % size:
+		sizes.append(trials % size)
+	streams = DiceRandom(seed).spawn(len(sizes))
+	deadline = time.monotonic() + simDeadline
+
+	if workers <= 1 or len(sizes) == 1:
+		chunks = []
+		for size, stream in zip(sizes, streams):
+			if time.monotonic() > deadline:
+				return Roll.__tooSlow__
+			chunks.append(simulateChunk(rollClass, message, size, stream))
+	else:
+		# Chunks that haven't started by the deadline are cancelled;
+		# the ones running finish by themselves
+		executor = getPool(workers)
+		futures = [executor.submit(simulateChunk, rollClass, message, size, stream) for size, stream in zip(sizes, streams)]
+		try:
+			chunks = [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+		except concurrent.futures.TimeoutError:
+			for future in futures:
+				future.cancel()
+			return Roll.__tooSlow__
+
+	# Combine the tallies
+	tally = {}
+	succeeded = 0
+	successes = 0
+	hasThreshold = False
+	for chunk in chunks:
+		if isinstance(chunk, str):
+			return chunk
+		for value, count in zip(chunk[0].tolist(), chunk[1].tolist()):
+			tally[value] = tally.get(value, 0) + count
+		succeeded += chunk[2]
+		successes += chunk[3]
+		hasThreshold = hasThreshold or chunk[4]
+
+	values = np.array(sorted(tally))
+	counts = np.array([tally[value] for value in values])
+
+	mean = float((values*counts).sum()/trials)
+	sd = float(np.sqrt((((values - mean)**2)*counts).sum()/trials))
+
+	cumulative = np.cumsum(counts)
+	percentiles = {}
+	for p in (1, 5, 25, 50, 75, 95, 99):
+		percentiles[p] = int(values[np.searchsorted(cumulative, p/100*trials)])
+
+	# Compact histogram: one bin per value if there are few,
+	# otherwise equal-width bins over the full range
+	if len(values) <= histogramBins:
+		histogram = [(int(v), int(v), int(c)) for v, c in zip(values, counts)]
+	else:
+		low = int(values[0])
+		width = -(-(int(values[-1]) - low + 1)//histogramBins)
+		binCounts = np.bincount((values - low)//width, weights=counts)
+		histogram = [(low + i*width, low + (i + 1)*width - 1, int(c)) for i, c in enumerate(binCounts)]
+
+	successRate = None
+	meanSuccesses = None
+	if hasThreshold:
+		successRate = succeeded/trials
+		meanSuccesses = successes/trials
+
+	return SimResult(trials, mean, sd, percentiles, successRate, meanSuccesses, histogram)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Dicey saved command stores
+CommandStore keeps the saved commands in memory. Changes are queued
+and appended to a journal file in batches, and the journal is folded
+back into the snapshot file every so often.
+SqliteStore keeps them in an SQLite database with a namespace per
+guild, for hosting many servers from one bot.
+
+Both take a guild with every call; CommandStore shares one namespace
+between every guild, as customRolls.json always has.
+
+A saved command is its roll expression, or a dict of the expression
+("roll") and its compiled plan ("plan"); see savedRoll.
+
+	python diceStore.py migrate customRolls.json customRolls.db [guild]
+
+copies a JSON store into a guild of an SQLite one.
+"""
+
+"""
+Imports
+"""
+import json
+import os
+import sys
+import threading
+from bisect import bisect_left
+from bisect import insort
+
+from diceLazy import lazyImport
+
+sqlite3 = lazyImport("sqlite3")
+
+"""
+Global variables
+"""
+
+journalSuffix = ".journal"
+
+# Journal entries allowed to build up before compacting into the snapshot
+compactLimit = 1000
+
+# Queued changes that trigger a write without waiting for a flush
+pendingLimit = 100
+
+# Most commands saved in a store (JSON) or a guild (SQLite)
+commandLimit = 1000
+
+def savedRoll(command):
+	"""
+	The roll expression of a saved command, with or without a plan
+	"""
+	if isinstance(command, dict):
+		return command["roll"]
+	return command
+
+"""
+JSON store
+"""
+
+class CommandStore:
+	"""
+	Saved commands by name, read from memory. The snapshot at path is
+	the same flat JSON dict customRolls.json has always been, and the
+	journal next to it holds one JSON change per line: ["set", name,
+	value] or ["delete", name].
+	"""
+
+	def __init__(self, path, quota=commandLimit):
+		self.path = path
+		self.journalPath = path + journalSuffix
+		self.quota = quota
+		self.lock = threading.Lock()
+		self.commands = {}
+		self.names = []
+		self.pending = []
+		self.journalLength = 0
+		self.load()
+
+	def load(self):
+		"""
+		Reads the snapshot and replays the journal over it.
+		Raises ValueError if the snapshot is malformed.
+		"""
+		commands = {}
+		if os.path.exists(self.path):
+			with open(self.path, 'r') as jsonFile:
+				dictString = jsonFile.read()
+			if len(dictString) != 0:
+				commands = json.loads(dictString)
+				if not isinstance(commands, dict):
+					raise ValueError
+
+		length = 0
+		if os.path.exists(self.journalPath):
+			with open(self.journalPath, 'rb+') as journal:
+				good = 0
+				for line in journal:
+					try:
+						# Every change is written with its newline, so one
+						# without is a write cut off partway
+						if not line.endswith(b"\n"):
+							raise ValueError
+						change = json.loads(line)
+					except ValueError:
+						# Nothing after it made it either; cut it off so
+						# later changes aren't appended to it
+						journal.truncate(good)
+						break
+					self.apply(commands, change)
+					good += len(line)
+					length += 1
+
+		with self.lock:
+			self.commands = commands
+			self.names = sorted(commands)
+			self.journalLength = length
+
+	def apply(self, commands, change):
+		if change[0] == "set":
+			commands[change[1]] = change[2]
+		elif change[0] == "delete":
+			commands.pop(change[1], None)
+
+	def get(self, guild, name):
+		return self.commands.get(name)
+
+	def count(self, guild):
+		return len(self.commands)
+
+	def full(self, guild):
+		return len(self.commands) > self.quota
+
+	def items(self, guild, prefix="", offset=0, limit=None):
+		"""
+		(name, command) pairs in name order, for names starting
+		with prefix, skipping offset of them and giving at most limit
+		"""
+		start = bisect_left(self.names, prefix) + offset
+		stop = len(self.names) if limit is None else start + limit
+
+		items = []
+		for name in self.names[start:stop]:
+			if not name.startswith(prefix):
+				break
+			items.append((name, self.commands[name]))
+		return items
+
+	def set(self, guild, name, command):
+		with self.lock:
+			if name not in self.commands:
+				insort(self.names, name)
+			self.change(["set", name, command])
+
+	def delete(self, guild, name):
+		"""
+		Deletes a command and returns it, or None if there wasn't one
+		"""
+		with self.lock:
+			command = self.commands.get(name)
+			if command is not None:
+				del self.names[bisect_left(self.names, name)]
+				self.change(["delete", name])
+		return command
+
+	def change(self, change):
+		self.apply(self.commands, change)
+		self.pending.append(json.dumps(change))
+		if len(self.pending) >= pendingLimit:
+			self.flushLocked()
+
+	def flush(self):
+		"""
+		Appends queued changes to the journal, compacting it
+		into the snapshot if it's grown long
+		"""
+		with self.lock:
+			self.flushLocked()
+
+	def flushLocked(self):
+		if self.pending:
+			with open(self.journalPath, 'a') as journal:
+				journal.write("\n".join(self.pending) + "\n")
+			self.journalLength += len(self.pending)
+			self.pending = []
+
+		if self.journalLength >= compactLimit:
+			self.compactLocked()
+
+	def compact(self):
+		"""
+		Writes everything to the snapshot and empties the journal
+		"""
+		with self.lock:
+			self.pending = []
+			self.compactLocked()
+
+	def compactLocked(self):
+		# The snapshot is replaced whole, so a crash leaves either the
+		# old one and its journal or the new one; replaying the journal
+		# over the new one changes nothing
+		with open(self.path + ".tmp", 'w') as jsonFile:
+			json.dump(self.commands, jsonFile)
+			jsonFile.flush()
+			os.fsync(jsonFile.fileno())
+		os.replace(self.path + ".tmp", self.path)
+
+		open(self.journalPath, 'w').close()
+		self.journalLength = 0
+
+"""
+SQLite store
+"""
+
+class SqliteStore:
+	"""
+	Saved commands keyed by (guild, name) in an SQLite database in WAL
+	mode. Each write is committed as it's made; listings walk the key's
+	index in name order, so they never sort. A command's expression and
+	its plan (as JSON) are kept in separate columns.
+	"""
+
+	def __init__(self, path, quota=commandLimit):
+		self.path = path
+		self.quota = quota
+		self.lock = threading.Lock()
+
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		self.connection.execute("""CREATE TABLE IF NOT EXISTS commands (
+									guild INTEGER NOT NULL,
+									name TEXT NOT NULL,
+									command TEXT NOT NULL,
+									plan TEXT,
+									PRIMARY KEY (guild, name)) WITHOUT ROWID""")
+
+		# Databases made before plans were saved
+		columns = [row[1] for row in self.connection.execute("PRAGMA table_info(commands)")]
+		if "plan" not in columns:
+			self.connection.execute("ALTER TABLE commands ADD COLUMN plan TEXT")
+		self.connection.commit()
+
+	def fromRow(self, command, plan):
+		if plan is None:
+			return command
+		return {"roll": command, "plan": json.loads(plan)}
+
+	def toRow(self, command):
+		if isinstance(command, dict):
+			return command["roll"], json.dumps(command["plan"])
+		return command, None
+
+	def query(self, sql, parameters=()):
+		with self.lock:
+			return self.connection.execute(sql, parameters).fetchall()
+
+	def write(self, sql, parameters=()):
+		with self.lock:
+			with self.connection:
+				return self.connection.execute(sql, parameters).rowcount
+
+	def get(self, guild, name):
+		rows = self.query("SELECT command, plan FROM commands WHERE guild = ? AND name = ?", (guild, name))
+		return self.fromRow(*rows[0]) if rows else None
+
+	def count(self, guild):
+		return self.query("SELECT COUNT(*) FROM commands WHERE guild = ?", (guild,))[0][0]
+
+	def full(self, guild):
+		return self.count(guild) > self.quota
+
+	def items(self, guild, prefix="", offset=0, limit=None):
+		"""
+		(name, command) pairs in name order, for names starting
+		with prefix, skipping offset of them and giving at most limit
+		"""
+		# Names starting with prefix sort between prefix and prefix
+		# followed by the last code point
+		rows = self.query("""SELECT name, command, plan FROM commands
+							 WHERE guild = ? AND name >= ? AND name < ?
+							 ORDER BY name LIMIT ? OFFSET ?""",
+						  (guild, prefix, prefix + "\U0010ffff", -1 if limit is None else limit, offset))
+		return [(name, self.fromRow(command, plan)) for name, command, plan in rows]
+
+	def set(self, guild, name, command):
+		self.write("INSERT OR REPLACE INTO commands (guild, name, command, plan) VALUES (?, ?, ?, ?)",
+				   (guild, name) + self.toRow(command))
+
+	def delete(self, guild, name):
+		"""
+		Deletes a command and returns it, or None if there wasn't one
+		"""
+		with self.lock:
+			with self.connection:
+				rows = self.connection.execute("SELECT command, plan FROM commands WHERE guild = ? AND name = ?",
+											   (guild, name)).fetchall()
+				if not rows:
+					return None
+				self.connection.execute("DELETE FROM commands WHERE guild = ? AND name = ?", (guild, name))
+		return self.fromRow(*rows[0])
+
+	def flush(self):
+		# Writes are committed as they're made
+		pass
+
+	def compact(self):
+		"""
+		Folds the write-ahead log back into the database
+		"""
+		with self.lock:
+			self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+	def migrate(self, jsonPath, guild=0):
+		"""
+		Copies every command of a JSON store into guild, keeping
+		any the guild already has. Returns how many were copied.
+		"""
+		commands = CommandStore(jsonPath).items(None)
+		with self.lock:
+			with self.connection:
+				return self.connection.executemany("INSERT OR IGNORE INTO commands (guild, name, command, plan) VALUES (?, ?, ?, ?)",
+												   [(guild, name) + self.toRow(command) for name, command in commands]).rowcount
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (4, 5) or sys.argv[1] != "migrate":
+		print("Usage: python diceStore.py migrate customRolls.json customRolls.db [guild]")
+		sys.exit(1)
+
+	copied = SqliteStore(sys.argv[3]).migrate(sys.argv[2], int(sys.argv[4]) if len(sys.argv) == 5 else 0)
+	print("Copied " + str(copied) + " commands")
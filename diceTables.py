@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Dicey weighted tables
+Tables of values with integer weights, compiled once into alias
+tables so a draw costs the same however long the table is. Tables can
+come from code or from a JSON or CSV file, read again when it changes.
+"""
+
+"""
+Imports
+"""
+import json
+import logging
+import os
+import threading
+
+from diceLazy import lazyImport
+
+csv = lazyImport("csv")
+np = lazyImport("numpy")
+
+"""
+Weighted tables
+"""
+
+class WeightedTable:
+	"""
+	Values with integer weights, in an alias table: a draw picks a
+	column at random and takes its value or its alias, depending on
+	a second number. Weights stay integers, so the odds are exact.
+	"""
+
+	def __init__(self, name, entries):
+		self.name = name
+		self.values = []
+		weights = []
+		for value, weight in entries:
+			weight = int(weight)
+			if weight < 0:
+				raise ValueError("Table " + name + " has a negative weight for " + str(value))
+			if weight > 0:
+				self.values.append(value)
+				weights.append(weight)
+		if len(weights) == 0:
+			raise ValueError("Table " + name + " has nothing to draw")
+
+		# Vose's method, with every weight scaled so a column holds total
+		n = len(weights)
+		self.total = sum(weights)
+		scaled = [weight*n for weight in weights]
+		cut = [self.total]*n
+		alias = list(range(n))
+		small = [i for i in range(n) if scaled[i] < self.total]
+		large = [i for i in range(n) if scaled[i] >= self.total]
+		while small and large:
+			less = small.pop()
+			more = large.pop()
+			cut[less] = scaled[less]
+			alias[less] = more
+			scaled[more] -= self.total - scaled[less]
+			if scaled[more] < self.total:
+				small.append(more)
+			else:
+				large.append(more)
+
+		self.weights = weights
+		self.cut = np.array(cut, dtype=np.int64)
+		self.alias = np.array(alias)
+
+	def draw(self, rng, size=None):
+		"""
+		A value from a DiceRandom stream, or a list of size of them
+		"""
+		columns = rng.generator.integers(0, len(self.values), size=size)
+		splits = rng.generator.integers(0, self.total, size=size)
+		picks = np.where(splits < self.cut[columns], columns, self.alias[columns])
+		if size is None:
+			return self.values[int(picks)]
+		return [self.values[pick] for pick in picks]
+
+	def probability(self, value):
+		return sum([weight for item, weight in zip(self.values, self.weights) if item == value])/self.total
+
+"""
+Table sets
+"""
+
+class TableSet:
+	"""
+	WeightedTables by name: defaults, given as {name: {value: weight}},
+	and those in the file at path, which take their place. A JSON file
+	holds the same dict; a CSV file has table, value, weight rows.
+	"""
+
+	def __init__(self, defaults=None, path=None):
+		# Defaults are compiled the first time they're drawn from
+		self.defaults = defaults or {}
+		self.compiled = {}
+		self.path = path
+		self.mtime = None
+		self.loaded = {}
+		self.lock = threading.Lock()
+
+	def compile(self, tables):
+		return {name: WeightedTable(name, entries.items()) for name, entries in tables.items()}
+
+	def refresh(self):
+		"""
+		Reads the file again if it changed. A file that's gone takes
+		its tables with it; one that's malformed keeps the last good ones.
+		"""
+		if self.path is None:
+			return
+
+		try:
+			mtime = os.stat(self.path).st_mtime_ns
+		except OSError:
+			self.loaded = {}
+			self.mtime = None
+			return
+
+		if mtime != self.mtime:
+			with self.lock:
+				if mtime != self.mtime:
+					try:
+						self.loaded = self.load()
+					except (IOError, ValueError, TypeError, AttributeError, IndexError) as e:
+						logging.warning("Couldn't read tables from " + self.path + ": " + str(e))
+					self.mtime = mtime
+
+	def load(self):
+		with open(self.path, newline='') as tableFile:
+			if self.path.endswith(".csv"):
+				tables = {}
+				for line in csv.reader(tableFile):
+					if len(line) > 0:
+						tables.setdefault(line[0], {})[line[1]] = line[2]
+			else:
+				tables = json.load(tableFile)
+		return self.compile(tables)
+
+	def __getitem__(self, name):
+		table = self.loaded.get(name)
+		if table is None:
+			table = self.compiled.get(name)
+			if table is None:
+				table = self.compiled[name] = WeightedTable(name, self.defaults[name].items())
+		return table
+
+	def __contains__(self, name):
+		return name in self.loaded or name in self.defaults
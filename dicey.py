@@ -9,20 +9,38 @@ Imports
 """
 
 import asyncio
-import csv
-import discord
-import json
+import contextvars
 import logging
-import os
-import re
-import urllib.request
-from numpy import floor
-from random import choice
-from random import randint
-from urllib.parse import quote
+import sys
+import time
+from functools import lru_cache
+from math import floor
 
 from diceClasses import *
-from dicey_token import token
+from diceLazy import lazyImport
+from diceExecutor import RollExecutor
+from diceExecutor import __busy__
+from diceMetrics import metrics
+from diceMetrics import metricsInterval
+from diceMood import MoodSearch
+from diceMood import videoUrl
+from diceNames import NameIndex
+from diceOdds import summarize
+from diceRandom import getRandom
+from diceRouter import Router
+from diceSend import SendQueue
+from diceSim import __overTrials__
+from diceSim import __overWork__
+from diceSim import simulate
+from diceStore import CommandStore
+from diceStore import SqliteStore
+from diceStore import commandLimit
+from diceStore import savedRoll
+from diceTables import TableSet
+
+# Only loaded once there's a bot to run or an embed to make
+aiohttp = lazyImport("aiohttp")
+discord = lazyImport("discord")
 
 """
 Global variables
@@ -30,16 +48,20 @@ Global variables
 
 logging.basicConfig(level=logging.INFO)
 
-intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
-
-discord.opus.load_opus
+# Made by getClient when the bot starts
+client = None
 
 prefix = "$"
 
+# Commands are registered with the router by their handlers, below
+router = Router(prefix)
+slowDown = "Slow down a little! Try that again in a few seconds."
+
+# Replies go out through here, paced per channel; see diceSend
+sendQueue = SendQueue()
 
 cRoll = prefix + "croll"
+cRollOdds = cRoll + " odds"
 simpleRoll = prefix + "roll"
 trosRoll = prefix + "tros"
 disconnect = prefix + "disconnect"
@@ -57,6 +79,8 @@ greetRobot = ["hi", "hello", "meet", "here"]
 
 mood = prefix + "mood"
 genericSearches = ["dungeon", "adventure", "rpg", "dungeons and dragons", "d&d", "background", "fantasy", "video game"]
+moodSearch = MoodSearch()
+moodResults = 5
 moodChoices = ["creepy", "epic", "battle", "crypt", "enchanted", "village", "woods", "winter", "city", "desert"]
 
 name = prefix + "name"
@@ -64,18 +88,69 @@ nameType = prefix + "nametypes"
 nameFile = "nameList.csv"
 nameFail = "Sorry, you sent a specifier that's not used. Use "+prefix+"nametypes to see what's available."
 fileFail = "No name file (" + nameFile + ") found."
+nameIndex = NameIndex(nameFile)
+nameLimit = 100
 
 weather = prefix + "weather"
+weatherDays = 14
+
+# Weights out of 100 for each climate. Tables of the same names in
+# weatherFile take the place of these, as soon as it's saved.
+weatherFile = "weatherTables.json"
+weatherTables = TableSet({"temperature.warm": {"severely hot.": 5, "hot.": 20, "warm.": 55, "moderate.": 20},
+						  "temperature.temperate": {"hot.": 5, "warm.": 30, "moderate.": 50, "cold.": 15},
+						  "temperature.cold": {"warm.": 9, "moderate.": 25, "cold.": 55, "severely cold.": 11},
+						  "wind.warm": {"Fair": 68, "Varies": 26, "Storm": 6},
+						  "wind.temperate": {"Fair": 61, "Varies": 33, "Storm": 6},
+						  "wind.cold": {"Fair": 56, "Varies": 36, "Storm": 8},
+						  "precipitation.warm": {"Skies are clear.": 62, "It's raining.": 36, "It's foggy.": 2},
+						  "precipitation.temperate": {"Skies are clear.": 68, "It's raining.": 23, "It's foggy.": 6, "It's snowing.": 3},
+						  "precipitation.cold": {"Skies are clear.": 70, "It's raining.": 10, "It's foggy.": 9, "It's snowing.": 11},
+						  "strength.Fair": {"Still": 10, "Light": 55, "Moderate": 25, "Strong": 9, "Severe": 1},
+						  "strength.Varies": {"Light": 20, "Moderate": 45, "Strong": 20, "Severe": 13, "Gale": 2},
+						  "strength.Storm": {"Strong": 10, "Severe": 40, "Gale": 40, "Hurricane": 2, "Dire gale": 1},
+						  "direction": {"prevailing direction. ": 60, "north. ": 5, "northeast. ": 5, "east. ": 5, "southeast. ": 5,
+										"south. ": 5, "southwest. ": 5, "west. ": 5, "northwest. ": 5}},
+						 weatherFile)
+
+sailingDict = {"Still": "Ships are becalmed.",
+			   "Light": "Sailing is normal.",
+			   "Moderate": "2x sailing speed.",
+			   "Strong":  "3x sailing speed.",
+			   "Severe": "Ships are driven by the wind. A profession (sailing) check DC 20 instead allows sailing at 3x speed.",
+			   "Gale": "Ships are driven by the wind. A profession (sailing) check DC 30 instead allows sailing at 3x speed.",
+			   "Hurricane": "Ships are driven by the wind.",
+			   "Dire gale": "Ships are driven by the wind."}
+
+emojiDict = {"Skies are clear.": ":sun:",
+			 "It's raining.": ":cloud_rain:",
+			 "It's foggy.": ":fog:",
+			 "It's snowing.": ":cloud_snow:"}
 
 save = prefix + "save"
 useSaved = prefix + "saved"
 rollsFile = "customRolls.json"
+
+# "json" keeps one set of commands in rollsFile for every server;
+# "sqlite" keeps a set per server in rollsDatabase. Move commands from
+# one to the other with: python diceStore.py migrate
+storeType = "json"
+rollsDatabase = "customRolls.db"
+commandStore = None
+flushInterval = 5
 delete = prefix + "delete"
 getCommandsList = prefix + "commands"
+# Longest line of $commands, and how many fit on a page with room to
+# say where the next one is; pages hold a fixed number so the store can
+# skip straight to one
+commandWidth = 100
+pageSize = 1900//(commandWidth + 4)
 saveHelp = prefix + "savehelp"
-saveDoc = """
+@lru_cache(maxsize=None)
+def getSaveDoc():
+	return """
 ```
-Dicey can save up to 1000 custom commands to be accessed later.
+Dicey can save up to """ + str(commandLimit) + """ custom commands to be accessed later.
 In your command name, use only ASCII characters and do not use spaces.
 Uses the file """ + rollsFile + """ in the same directory as Dicey's code.
 Commands are specific to the computer Dicey is running on!
@@ -83,33 +158,58 @@ Commands are specific to the computer Dicey is running on!
 """+prefix+"""save [name] [command] saves a simple roll command under "name" and sends an example roll. This will NOT overwrite an existing command. Make sure you put a space between [name] and [command].
 """+prefix+"""saved [name] accesses the saved command "name"
 """+prefix+"""delete [name] deletes command "name"
-"""+prefix+"""commands sends a list of all available custom commands. This may be long!
+"""+prefix+"""commands [prefix] [page] sends a page of the available custom commands, only those starting with prefix if one is given
 ```
 """
 
 turn = prefix + "turn"
 
-helpDoc = """
+odds = prefix + "odds"
+
+# Rolls run off the event loop, set up by the settings in diceExecutor
+rollExecutor = RollExecutor()
+
+sim = prefix + "sim"
+simTypes = {"roll": Roll, "croll": CoC, "tros": RoS}
+
+stats = prefix + "stats"
+
+# Failures counted as hitting a limit rather than as bad input
+limitMessages = {Roll.__overRolls__, Roll.__overDigits__, Roll.__badExplode__, Roll.__tooComplex__, __overTrials__, __overWork__}
+
+@lru_cache(maxsize=None)
+def getHelpDoc():
+	return """
 ```
 """+prefix+"""roll [[iterations]x][[number]d[die type]][+[bonus]][other keys][,[new roll]]
 Use """+prefix+"""SimpleRollHelp for info and examples.
 
 """+prefix+"""croll [[number=1][b OR p]]...[[score][threshold]]
 Use """+prefix+"""CoCRollHelp for info and examples.
+"""+prefix+"""croll odds [skill]t [bonus/penalty] works out the chance of each level of success.
 
 """+prefix+"""tros [[iterations]x][[pool]/[target number]] OR simple roll[, [new roll]]
 Use """+prefix+"""trosRollHelp for info and examples.
 
+"""+prefix+"""odds [simple roll]
+Works out the exact odds of a simple roll without rolling it.
+
+"""+prefix+"""sim [trials] [roll/croll/tros] [command]
+Simulates up to 10000000 rolls and reports the spread of results. Defaults to a simple roll.
+
 """+prefix+"""mood [search terms]
 Sends a random youtube video found by searching rpg-background-music type keywords.
 No argument returns a generic video chosen from a list of words (like "battle," "village," etc.)
 Or add your own search terms
 
-"""+prefix+"""name [origin] [label]
+"""+prefix+"""name [number] [origin] [label]
 Sends name chosen from a file in the same directory as Dicey's code, called """ + nameFile + """
-Origin and label are optional specifiers. 
+Number, origin and label are optional specifiers. 
 Use """+prefix+"""nametypes for more info.
 
+"""+prefix+"""weather [climate] [days]
+Rolls the weather for a warm, temperate or cold climate, for today or a forecast of up to """ + str(weatherDays) + """ days.
+
 """+prefix+"""turn [level] [charisma bonus]
 Rolls a 3.5E D&D turning check.
 
@@ -131,6 +231,9 @@ digitLimit = 10000
 
 FirstConnect=True
 
+# Users allowed to see the stats, filled in on connecting
+owners = set()
+
 COL_CRIT_SUCCESS=0xFFFFFF
 COL_EXTR_SUCCESS=0xf1c40f
 COL_HARD_SUCCESS=0x2ecc71
@@ -138,64 +241,79 @@ COL_NORM_SUCCESS=0x2e71cc
 COL_NORM_FAILURE=0xe74c3c
 COL_CRIT_FAILURE=0x992d22
 
+colorDict = {"severely hot.": COL_CRIT_FAILURE,
+			 "hot.": COL_NORM_FAILURE,
+			 "warm.": COL_EXTR_SUCCESS,
+			 "moderate.": COL_CRIT_SUCCESS,
+			 "cold.": COL_HARD_SUCCESS,
+			 "severely cold.": COL_NORM_SUCCESS}
+
 """
 Miscellaneous fun functions
 """
 
-def getMood(searchString):
+async def getMood(searchString):
+	"""
+	A random video from the first few results of a search
+	"""
 
 	if searchString == "":
-		search = " ".join([choice(moodChoices) for i in range(randint(1, 2))])
+		rng = getRandom()
+		search = " ".join([rng.choice(moodChoices) for i in range(rng.randint(1, 2))])
 	else:
 		#search = "\"" + searchString + "\""
 		search = searchString.strip()
 
 	#search += " " + choice(genericSearches)
 	search += " music"
-	search = quote(search)
 
 	print("Searching youtube for " + search)
 
-	page = urllib.request.urlopen('https://www.youtube.com/results?search_query=' + search)
-	html = str(page.read())
+	try:
+		with metrics.stage("http"):
+			results = await moodSearch.search(search)
+	except asyncio.TimeoutError:
+		return "Sorry, YouTube took too long to answer :cry:"
+	except aiohttp.ClientError:
+		return "Sorry, I couldn't reach YouTube :cry:"
 
-	results = []
-	for i in range(len(html)-9):
-	    if html[i:i+9] == "/watch?v=":
-	    	results.append(html[i:i+20])
+	if len(results) == 0:
+		return "Sorry, I couldn't find any videos for that."
 
-	return "https://www.youtube.com" + choice(results[:max([5, len(results)])])
+	return videoUrl + getRandom().choice(results[:moodResults])
 
 
 def getName(nameString):
+	"""
+	Random names from the name file, for an optional
+	count, origin and label
+	"""
 
-	names = []
-	origins = []
-	labels = []
-
-	try:
-		with open(nameFile) as csvfile:
-			reader = csv.reader(csvfile)
-			for line in reader:
-				names.append(line[0])
-				origins.append(line[1])
-				labels.append(line[2])
-	except IOError:
+	if not nameIndex.refresh():
 		return fileFail
 
+	# A leading number asks for that many different names
+	count = 1
+	words = nameString.split(" ")
+	if words[0].isdigit():
+		count = int(words[0])
+		nameString = " ".join(words[1:]).strip()
+		if count < 1 or count > nameLimit:
+			return "I can only pick between 1 and " + str(nameLimit) + " names at once."
+
 	origin = ""
 	label = ""
 
 	if " " in nameString:
 		origin = nameString.split(" ")[0]
 		label = nameString.split(" ")[-1]
-		if origin not in origins:
+		if origin not in nameIndex.origins:
 			return nameFail
-		if label not in labels and label != "name":
+		if label not in nameIndex.labels and label != "name":
 			return nameFail
-	elif nameString in origins:
+	elif nameString in nameIndex.origins:
 		origin = nameString
-	elif nameString in labels or nameString == "name":
+	elif nameString in nameIndex.labels or nameString == "name":
 		label = nameString
 	elif nameString == "":
 		label = "name"
@@ -205,49 +323,27 @@ def getName(nameString):
 	if label == "":
 		label = "name"
 
-	originNames = names.copy()
-	labelNames = names.copy()
-	if origin != "":
-		originNames = [names[i] for i in range(len(names)) if origins[i] == origin]
-	if label != "name":
-		labelNames = [names[i] for i in range(len(names)) if labels[i] == label]
-	else:
-		labelNames = [names[i] for i in range(len(names)) if labels[i] == "male" or labels[i] == "female"]
-
-	nameList = [item for item in originNames if item in labelNames]
+	nameList = nameIndex.draw(origin, label, count, getRandom())
 
 	if len(nameList) == 0:
 		return "Sorry, no names that match your request."
 
-	return choice(nameList)
+	return ", ".join(nameList)
 
 def getNameTypes():
 
-	origins = []
-	labels = []
-	try:
-		with open(nameFile) as csvfile:
-			reader = csv.reader(csvfile)
-			for line in reader:
-				origins.append(line[1])
-				labels.append(line[2])
-	except IOError:
+	if not nameIndex.refresh():
 		return fileFail
 
-	origins = list(set(origins))
-	labels = list(set(labels))
-
-	origins.sort()
-	labels.sort()
-
 	returnString = """
 	```
 Available name types:
-Origins: """ + ", ".join(origins) + """
-Labels: """ + ", ".join(labels) + """, name
+Origins: """ + ", ".join(nameIndex.originList) + """
+Labels: """ + ", ".join(nameIndex.labelList) + """, name
 
-Request names with """+prefix+"""name [origin] [label]. Both inputs are optional.
+Request names with """+prefix+"""name [number] [origin] [label]. All inputs are optional.
 The 'name' label will search over both male and female names. If no label is given, 'name' is used as the default.
+A number picks that many different names at once.
 ```"""
 
 	return returnString
@@ -259,13 +355,14 @@ def getTurn(turnString):
 	level = int(parse[0])
 	charisma = int(parse[1])
 
-	maxHD = level + floor((randint(1, 20) + charisma - 10)/3)
+	rng = getRandom()
+	maxHD = level + floor((rng.randint(1, 20) + charisma - 10)/3)
 	if maxHD < level - 4:
 		maxHD = level - 4
 	elif maxHD > level + 4:
 		maxHD = level + 4
 
-	damage = randint(1, 6) + randint (1, 6) + level + charisma
+	damage = rng.randint(1, 6) + rng.randint(1, 6) + level + charisma
 
 	damage = int(damage)
 	maxHD = int(maxHD)
@@ -279,80 +376,234 @@ def getTurn(turnString):
 	return title, footer
 
 def getWeather(weatherString):
+	"""
+	A weather report for a climate, for one day or a forecast of
+	several, with every day drawn at once
+	"""
+
+	words = weatherString.split()
+	days = 1
+	if len(words) > 1 and words[-1].isdigit():
+		days = int(words.pop())
+	if days < 1 or days > weatherDays:
+		return "I can forecast between 1 and " + str(weatherDays) + " days."
+
+	climate = " ".join(words)
+	if climate == "temp":
+		climate = "temperate"
+
+	weatherTables.refresh()
+	try:
+		rng = getRandom()
+		winds = weatherTables["wind." + climate].draw(rng, days)
+		temps = weatherTables["temperature." + climate].draw(rng, days)
+		precs = weatherTables["precipitation." + climate].draw(rng, days)
+		directions = weatherTables["direction"].draw(rng, days)
+
+		# Each kind of wind has its own strengths, drawn in the order
+		# the winds first come up so a seed always gives the same forecast
+		strengths = [None]*days
+		for wind in dict.fromkeys(winds):
+			windDays = [day for day in range(days) if winds[day] == wind]
+			for day, strength in zip(windDays, weatherTables["strength." + wind].draw(rng, len(windDays))):
+				strengths[day] = strength
+
+		reports = []
+		for day in range(days):
+			report = temps[day] + " "
+			report += precs[day] + "\n"
+			report += strengths[day] + " winds from the " + directions[day] + sailingDict[strengths[day]]
+			reports.append(report)
+
+		if days == 1:
+			weather = "Today is " + reports[0]
+		else:
+			weather = "\n\n".join(["Day " + str(day + 1) + " is " + report for day, report in enumerate(reports)])
+
+		weather += "\n\nClimate: " + climate
+
+		colour = colorDict.get(temps[0], COL_CRIT_SUCCESS)
+
+	except KeyError:
+		weather = "You sent a climate I don't recognize. Try warm, temperate/temp, or cold."
+		colour = COL_CRIT_SUCCESS
+
+	em = discord.Embed(title = "Weather Report" if days == 1 else str(days) + " Day Forecast",
+					   description = weather,
+					   colour = colour)
+
+	return em
 
-	if weatherString == "temp":
-		weatherString = "temperate"
+def getOdds(oddsString):
+	"""
+	Exact odds of a simple roll command
+	"""
+
+	result = Roll.distribution(oddsString)
+
+	# If result was a string, something failed; send string.
+	if isinstance(result, str):
+		return result
+
+	roll = Roll()
+	specs = roll.getPlan(oddsString).rolls
+
+	lines = []
+	for spec, dist in zip(specs, result):
+		line = roll.describe(spec) + (", each level:  " if dist.levels is not None else ":  ")
+
+		mean, sd, median = summarize(dist.totals)
+		likeliest = max(dist.totals, key=dist.totals.get)
+		line += "mean %.2f, sd %.2f, median %d, range %d to %d\n" % (mean, sd, median, min(dist.totals), max(dist.totals))
+		line += "most likely %d (%.2f%%)" % (likeliest, 100*dist.totals[likeliest])
+
+		if dist.successes is not None:
+			if max(dist.successes) > 1:
+				line += ", %.2f successes on average" % sum(n*p for n, p in dist.successes.items())
+			else:
+				line += ", %.2f%% success" % (100*dist.successes.get(1, 0.0))
+
+		if dist.levels is not None:
+			line += "\n%.2f levels on average" % dist.levels
+
+		if dist.unbounded > 0.00005:
+			line += "\nExplodes past my explosion limit %.2f%% of the time" % (100*dist.unbounded)
 
-	tempDict = {"warm": 5*["severely hot."] + 20*["hot."] + 55*["warm."] + 20*["moderate."],
-				"temperate": 5*["hot."] + 30*["warm."] + 50*["moderate."] + 15*["cold."],
-				"cold": 9*["warm."] + 25*["moderate."] + 55*["cold."] + 11*["severely cold."]}
+		lines.append(line)
 
-	windDict = {"warm": 68*["Fair"] + 26*["Varies"] + 6*["Storm"],
-				"temperate": 61*["Fair"] + 33*["Varies"] + 6*["Storm"],
-				"cold": 56*["Fair"] + 36*["Varies"] + 8*["Storm"]}
+	desc = "\n".join(lines)
+	if len(desc) >= 2048:
+		desc = desc[:2044] + "..."
 
-	precDict = {"warm": 62*["Skies are clear."] + 36*["It's raining."] + 2*["It's foggy."],
-				"temperate": 68*["Skies are clear."] + 23*["It's raining."] + 6*["It's foggy."] + 3*["It's snowing."],
-				"cold": 70*["Skies are clear."] + 10*["It's raining."] + 9*["It's foggy."] + 11*["It's snowing."]}
+	em = discord.Embed(title = "Odds for " + oddsString.strip(),
+					   description = desc,
+					   colour = COL_NORM_SUCCESS)
 
-	strengthDict = {"Fair": 10*["Still"] + 55*["Light"] + 25*["Moderate"] + 9*["Strong"] + 1*["Severe"],
-					"Varies": 20*["Light"] + 45*["Moderate"] + 20*["Strong"] + 13*["Severe"] + 2*["Gale"],
-					"Storm": 10*["Strong"] + 40*["Severe"] + 40*["Gale"] + 2*["Hurricane"] + 1*["Dire gale"]}
+	return em
+
+def getTierOdds(tierString):
+	"""
+	Exact chance of each success tier of a croll command
+	"""
+
+	roll = CoC()
+	plan = roll.getPlan(tierString)
+	if plan is ValueError:
+		return roll.__fail__
+	elif isinstance(plan, str):
+		return plan
 
-	sailingDict = {"Still": "Ships are becalmed.",
-				   "Light": "Sailing is normal.",
-				   "Moderate": "2x sailing speed.",
-				   "Strong":  "3x sailing speed.",
-				   "Severe": "Ships are driven by the wind. A profession (sailing) check DC 20 instead allows sailing at 3x speed.",
-				   "Gale": "Ships are driven by the wind. A profession (sailing) check DC 30 instead allows sailing at 3x speed.",
-				   "Hurricane": "Ships are driven by the wind.",
-				   "Dire gale": "Ships are driven by the wind."}
+	spec = plan.rolls[0]
+	if spec.success is None:
+		return "I need a skill to work out the odds against, like " + cRollOdds + " 60t 1b"
 
-	direction = 60*["prevailing direction. "] + 5*["north. "] + 5*["northeast. "] + 5*["east. "] + 5*["southeast. "] + 5*["south. "] + 5*["southwest. "] + 5*["west. "] + 5*["northwest. "]
+	bonus = 0 if spec.keepFlag else spec.drop
+	penalty = spec.drop if spec.keepFlag else 0
+	chances = CoC.tierProbabilities(spec.success, bonus, penalty)
 
-	colorDict = {"severely hot.": COL_CRIT_FAILURE,
-				 "hot.": COL_NORM_FAILURE,
-				 "warm.": COL_EXTR_SUCCESS,
-				 "moderate.": COL_CRIT_SUCCESS,
-				 "cold.": COL_HARD_SUCCESS,
-				 "severely cold.": COL_NORM_SUCCESS}
+	lines = [tier + " %.2f%%" % (100*chance) for tier, chance in chances.items()]
+	passed = sum(list(chances.values())[:4])
+	lines.append("\nAny success %.2f%%" % (100*passed))
 
-	emojiDict = {"Skies are clear.": ":sun:",
-				 "It's raining.": ":cloud_rain:",
-				 "It's foggy.": ":fog:",
-				 "It's snowing.": ":cloud_snow:"}
+	em = discord.Embed(title = "Odds for " + roll.describe(spec),
+					   description = "\n".join(lines),
+					   colour = COL_NORM_SUCCESS)
 
+	return em
+
+def getSim(simString):
+	"""
+	Simulate many rolls of a roll command and summarize them
+	"""
+
+	parse = simString.strip().split(" ", 1)
 	try:
-		wind = choice(windDict[weatherString])
-		strength = choice(strengthDict[wind])
-		temp = choice(tempDict[weatherString])
-		prec = choice(precDict[weatherString])
+		trials = int(parse[0])
+	except ValueError:
+		return fail
+
+	# An optional command name picks the type of roll
+	expression = ""
+	rollClass = Roll
+	if len(parse) > 1:
+		words = parse[1].strip().split(" ", 1)
+		if words[0] in simTypes:
+			rollClass = simTypes[words[0]]
+			expression = words[1] if len(words) > 1 else ""
+		else:
+			expression = parse[1]
 
-		weather = "Today is " + temp + " "
-		weather += prec + "\n"
-		weather += strength + " winds from the " + choice(direction) + sailingDict[strength]
+	result = simulate(expression, trials, rollClass)
 
-		weather += "\n\nClimate: " + weatherString
+	# If result was a string, something failed; send string.
+	if isinstance(result, str):
+		return result
 
-		colour = colorDict[temp]
+	desc = "Mean %.2f, sd %.2f\n" % (result.mean, result.sd)
+	desc += "Percentiles: " + ", ".join([str(p) + "%: " + str(v) for p, v in result.percentiles.items()])
+	if result.successRate is not None:
+		desc += "\nAt least one success %.2f%% of the time, %.2f successes on average" % (100*result.successRate, result.meanSuccesses)
 
-	except KeyError:
-		weather = "You sent a climate I don't recognize. Try warm, temperate/temp, or cold."
-		colour = COL_CRIT_SUCCESS
+	# Draw the histogram
+	width = max([len("%d-%d" % (low, high)) for low, high, count in result.histogram])
+	most = max([count for low, high, count in result.histogram])
+	bars = []
+	for low, high, count in result.histogram:
+		label = str(low) if low == high else "%d-%d" % (low, high)
+		bars.append(label.ljust(width) + " " + "\u2588"*round(20*count/most) + " %.1f%%" % (100*count/result.trials))
+	desc += "\n```\n" + "\n".join(bars) + "\n```"
 
-	em = discord.Embed(title = "Weather Report",
-					   description = weather,
-					   colour = colour)
+	em = discord.Embed(title = "Simulated " + str(trials) + " rolls of " + (expression.strip() or "the default"),
+					   description = desc,
+					   colour = COL_NORM_SUCCESS)
 
 	return em
 
-def saveCommand(commandString):
+def getStore():
+	"""
+	The saved command store, loaded from file on first use.
+	Returns an error string if the file is malformed.
+	"""
+	global commandStore
+
+	if commandStore is None:
+		with metrics.stage("io"):
+			try:
+				if storeType == "sqlite":
+					commandStore = SqliteStore(rollsDatabase)
+				else:
+					commandStore = CommandStore(rollsFile)
+			except ValueError:
+				return "There was an error in the format of " + rollsFile
+
+	return commandStore
+
+async def flushCommands():
 	"""
-	Save a custom roll command
+	Writes saved command changes out to file, off the event loop
 	"""
+	if commandStore is not None:
+		with metrics.stage("io"):
+			await asyncio.get_running_loop().run_in_executor(None, commandStore.flush)
 
-	if not os.path.exists(rollsFile):
-		open(rollsFile, 'x').close()
+async def rollCommand(rollClass, expression=None, plan=None):
+	"""
+	Rolls and formats off the event loop, recording how long it took.
+	Returns the result and the plan rolled, or an error string and None.
+	"""
+	with metrics.stage("work"):
+		work = await rollExecutor.roll(rollClass, expression, plan)
+	if isinstance(work, str):
+		return work, None
+
+	metrics.recordRoll(work)
+	metrics.record("format", work.formatTime)
+	return work.result, work.plan
+
+async def saveCommand(commandString, guild=0):
+	"""
+	Save a custom roll command for a guild
+	"""
 
 	result = ""
 	index = commandString.find(" ")
@@ -366,165 +617,166 @@ def saveCommand(commandString):
 			send = "That's more than 50 characters long. Try a shorter commands name."
 		else:
 
-			roll = Roll(commandString[index:].lower().strip())
-			result = roll.format()
+			rollString = commandString[index:].lower().strip()
+			result, plan = await rollCommand(Roll, rollString)
 
 			# If result was a string, something failed; send string.
 			if isinstance(result, str):
+				countFailure(result)
 				send = "Your roll command failed :cry: :\n" + result
 
 			else:
 
-				splitDesc = re.split(r":|\n", result.desc)
-
-				descriptionList = []
-				for n in range(0, len(splitDesc), 2):
-					description = splitDesc[n]
-					if "keep" in splitDesc[n+1]:
-						description += " keep " + str(splitDesc[n+1].count(",") + 1)
-					if "drop" in splitDesc[n+1]:
-						description += " drop " + str(splitDesc[n+1].count(",") + 1)
-
-					descriptionList.append(description)
-
-				cleanDesc = ", ".join(descriptionList)
-
-				cleanDesc = cleanDesc.replace("\u2265", ">=")
-				cleanDesc = cleanDesc.replace("\u2264", "<=")
+				# Save the compiled plan, so it's never parsed again,
+				# and the expression it compiles from to show
+				roll = Roll()
+				cleanDesc = roll.display(plan)
 
 				printDesc = cleanDesc
 				if len(cleanDesc) > 50:
 					printDesc = cleanDesc[:50] + "..."
 
-				with open(rollsFile, 'r') as jsonFile:
-					dictString = jsonFile.read()
+				store = getStore()
+				if isinstance(store, str):
+					send = store
+					result = ""
+					return send, result
 
-				if len(dictString) == 0:
-					commandsDict = {}
-				else:
-					try:
-						with open(rollsFile, 'r') as jsonFile:
-							commandsDict = json.load(jsonFile)
-					except:
-						send = "There was an error in the format of " + rollsFile
-						result = ""
-						return send, result
-
-				if name in commandsDict.keys():
-					send = "Command name already in use as " + commandsDict[name] + ". Delete it first to use this name."
+				saved = store.get(guild, name)
+				if saved is not None:
+					send = "Command name already in use as " + savedRoll(saved) + ". Delete it first to use this name."
 					result = ""
-				elif len(commandsDict) > 1000:
-					send = "I already have 1000 commands saved, to conserve space I won't save any more."
+				elif store.full(guild):
+					send = "I already have " + str(store.quota) + " commands saved, to conserve space I won't save any more."
 				else:
-					commandsDict[name] = cleanDesc
-
-					with open(rollsFile, 'w') as jsonFile:
-						json.dump(commandsDict, jsonFile)
+					store.set(guild, name, {"roll": cleanDesc, "plan": roll.dumpPlan(plan)})
 
 					send = "Saving command name '" + name + "' as " + printDesc + ". Here's an example:\n"
 
 	return send, result
 
 
-def deleteCommand(commandString):
-
-	if not os.path.exists(rollsFile):
-		open(rollsFile, 'x').close()
+def deleteCommand(commandString, guild=0):
 
-	with open(rollsFile, 'r') as jsonFile:
-		dictString = jsonFile.read()
+	store = getStore()
+	if isinstance(store, str):
+		return store
 
-	if len(dictString) == 0:
-		commandsDict = {}
+	command = store.delete(guild, commandString)
+	if command is None:
+		result = "Command not found. Nothing deleted."
 	else:
-		try:
-			with open(rollsFile, 'r') as jsonFile:
-				commandsDict = json.load(jsonFile)
-		except:
-			send = "There was an error in the format of " + rollsFile
-			return send
-
-		if commandString not in commandsDict.keys():
-			result = "Command not found. Nothing deleted."
-		else:
-			command = commandsDict[commandString]
-			commandsDict.pop(commandString)
-
-			if len(command) > 50:
-				command = command[:50] + "..."
+		command = savedRoll(command)
+		if len(command) > 50:
+			command = command[:50] + "..."
 
-			result = "Deleted command '" + commandString + "' " + command
-
-			with open(rollsFile, 'w') as jsonFile:
-				json.dump(commandsDict, jsonFile)			
+		result = "Deleted command '" + commandString + "' " + command
 
 	return result
 
 
-def getCommand(commandString):
-
-
-	if not os.path.exists(rollsFile):
-		open(rollsFile, 'x').close()
+async def getCommand(commandString, guild=0):
 
-	with open(rollsFile, 'r') as jsonFile:
-		dictString = jsonFile.read()
+	store = getStore()
+	if isinstance(store, str):
+		return store
 
-	if len(dictString) == 0:
-		commandsDict = {}
+	command = store.get(guild, commandString)
+	if command is None:
+		result = "Command not found."
 	else:
-		try:
-			with open(rollsFile, 'r') as jsonFile:
-				commandsDict = json.load(jsonFile)
-		except:
-			result = "There was an error in the format of " + rollsFile
-			return result
-
-		if commandString not in commandsDict.keys():
-			result = "Command not found."
+		roll = Roll()
+		plan = None
+		if isinstance(command, dict):
+			plan = roll.loadPlan(command["plan"])
+
+		if plan is not None:
+			result, plan = await rollCommand(Roll, plan=plan)
 		else:
-			command = commandsDict[commandString]
+			# Saved before plans were, or under another plan version;
+			# compile it again and save the new plan
+			result, plan = await rollCommand(Roll, savedRoll(command))
+			if plan is not None:
+				store.set(guild, commandString, {"roll": savedRoll(command), "plan": roll.dumpPlan(plan)})
 
-			roll = Roll(command)
-			result = roll.format()
+		if isinstance(result, str):
+			countFailure(result)
 
 	return result
 
-def getCommands():
+def getCommands(commandString="", guild=0):
+	"""
+	A page of a guild's saved commands, from an optional
+	name prefix and page number
+	"""
 
-	if not os.path.exists(rollsFile):
-		open(rollsFile, 'x').close()
+	store = getStore()
+	if isinstance(store, str):
+		return store
+
+	words = commandString.split()
+	page = 1
+	if words and words[-1].isdigit():
+		page = int(words.pop())
+	namePrefix = words[0] if words else ""
+	if page < 1:
+		return "Pages start at 1."
+
+	# One more than a page, to tell if there's another
+	items = store.items(guild, namePrefix, (page - 1)*pageSize, pageSize + 1)
+	if not items:
+		if page > 1:
+			return "There aren't that many pages of commands."
+		if namePrefix:
+			return "No commands start with " + namePrefix + "."
+		return "No commands saved yet."
+
+	lines = []
+	for key, value in items[:pageSize]:
+		command = key + ": " + savedRoll(value)
+		if len(command) > commandWidth:
+			command = command[:commandWidth] + "..."
+		lines.append(command)
+	result = "\n".join(lines)
+
+	if len(items) > pageSize:
+		result += "\n" + "More with " + " ".join([getCommandsList] + words + [str(page + 1)])
 
-	with open(rollsFile, 'r') as jsonFile:
-		dictString = jsonFile.read()
+	return result
 
-	if len(dictString) == 0:
-		commandsDict = {}
+def countFailure(result):
+	"""
+	Counts a roll that failed with result as a limit
+	rejection or as a failure to parse
+	"""
+	if result in limitMessages:
+		metrics.count("rejected")
+	elif result == Roll.__tooSlow__:
+		metrics.count("timedOut")
+	elif result == __busy__:
+		metrics.count("busy")
 	else:
-		try:
-			with open(rollsFile, 'r') as jsonFile:
-				commandsDict = json.load(jsonFile)
-		except:
-			result = "There was an error in the format of " + rollsFile
-			return result
-
-		commands = []
-		for key in sorted(commandsDict):
-			command = key + ": " + commandsDict[key]
-			if len(command) > 100:
-				command = command[:100] + "..."
-
-			commands.append(command)
-
-		result = "\n".join(commands)
-
-	return result
+		metrics.count("failed")
 
 """
 Functions that handle Discord events.
 """
 
-@client.event
+def getClient():
+	"""
+	The Discord client, made on first use with the events below
+	"""
+	global client
+
+	if client is None:
+		intents = discord.Intents.default()
+		intents.message_content = True
+		client = discord.Client(intents=intents)
+		client.event(on_ready)
+		client.event(on_message)
+
+	return client
+
 async def on_ready():
 	"""
 	Tells me the bot connected
@@ -533,181 +785,292 @@ async def on_ready():
 	print("Dicey connected")
 	if FirstConnect:
 		FirstConnect = False
+
+		app = await client.application_info()
+		owners.add(app.owner.id)
+		if app.team is not None:
+			owners.update([member.id for member in app.team.members])
+
+		nameIndex.refresh()
+		client.loop.create_task(writeMetrics())
+		client.loop.create_task(writeCommands())
 	await client.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=prefix+"roll, "+prefix+"help"))
 
-@client.event
-async def on_message(message):
+async def writeMetrics():
 	"""
-	Listens to incoming messages
+	Writes the metrics files every so often for anything scraping them
 	"""
-	# Disregard the bot's own messages
-	if message.author == client.user:
-		return
+	while True:
+		await asyncio.sleep(metricsInterval)
+		try:
+			metrics.write()
+		except OSError as e:
+			logging.warning("Couldn't write metrics: " + str(e))
 
-	# Get basic info
-	parse = message.content.lower()
+async def writeCommands():
+	"""
+	Writes saved command changes out every few seconds
+	"""
+	while True:
+		await asyncio.sleep(flushInterval)
+		try:
+			await flushCommands()
+		except OSError as e:
+			logging.warning("Couldn't save commands: " + str(e))
+
+async def send(channel, content=None, embed=None, coalesce=False):
+	"""
+	Sends to a channel through the send queue, timing how long it
+	takes to go. Roll results that may go out with others coalesce.
+	"""
+	with metrics.stage("send"):
+		return await sendQueue.send(channel, content, embed, coalesce)
+
+def rollAuthor(message):
 	if isinstance(message.author.nick, str):
 		author = message.author.nick
 	else:
 		author = message.author.name
-	author += "'s roll"
-
-	# Handle help requests
-	if parse == doc:
-		await message.channel.send(helpDoc)
-
-	elif parse == simpleHelp:
-		await message.channel.send(simpleRollDoc)
+	return author + "'s roll"
 
-	elif parse == cRollHelp:
-		await message.channel.send(cRollDoc)
-
-	elif parse == trosRollHelp:
-		await message.channel.send(trosRollDoc)
-
-	# Handle a roll command
-	elif parse.startswith(simpleRoll):
+def renderResult(result, message):
+	"""
+	Embed of a DiceResult, titled with its total and credited to
+	whoever rolled it
+	"""
+	with metrics.stage("render"):
+		em = discord.Embed(title = result.title,
+							description = rollAuthor(message),
+							colour = result.colour)
+		em.set_footer(text = result.desc)
 
-		roll = Roll(parse[len(simpleRoll):])
-		result = roll.format()
+	return em
 
-		# If result was a string, something failed; send string.
-		if isinstance(result, str):
-			await message.channel.send(result)
+async def reply(message, result):
+	"""
+	Sends what a handler returned: None, a string, an embed, a
+	DiceResult, or a tuple of a string and one of the last two
+	"""
+	if result is None:
+		return
 
-		else:
-			em = discord.Embed(title = result.title,
-								description = author,
-								colour = result.colour)
-			em.set_footer(text = result.desc)
+	text = None
+	if isinstance(result, tuple):
+		text, result = result
+	coalesce = isinstance(result, DiceResult)
+	if coalesce:
+		result = renderResult(result, message)
 
-			await message.channel.send(embed=em)
+	if isinstance(result, discord.Embed):
+		await send(message.channel, text, embed=result, coalesce=coalesce)
+	else:
+		await send(message.channel, result)
 
-	elif parse.startswith(useSaved):
+async def on_message(message):
+	"""
+	Listens to incoming messages, timing how long each command takes
+	"""
+	start = time.perf_counter()
+	try:
+		await respond(message)
+	except Exception:
+		metrics.count("errors")
+		raise
+	finally:
+		metrics.record("total", time.perf_counter() - start)
+
+async def respond(message):
+	"""
+	Handles an incoming message
+	"""
+	# Disregard the bot's own messages
+	if client is not None and message.author == client.user:
+		return
 
-		result = getCommand(message.content[len(useSaved):].strip())
+	command, args = router.route(message.content)
+	if command is None:
+		await chatter(message)
+		return
 
-		# If result was a string, something failed; send string.
-		if isinstance(result, str):
-			await message.channel.send(result)
+	metrics.begin(command.name)
+	if not router.allow(command, message.author.id):
+		metrics.count("limited")
+		await send(message.channel, slowDown)
+		return
 
-		else:
-			em = discord.Embed(title = result.title,
-								description = author,
-								colour = result.colour)
-			em.set_footer(text = result.desc)
-
-			await message.channel.send(embed=em)
-
-	elif parse.startswith(saveHelp):
-		await message.channel.send(saveDoc)
-
-	elif parse.startswith(save):
-		send, result = saveCommand(message.content[len(save):].strip())
-		if not (isinstance(result, str)):
-			em = discord.Embed(title = result.title,
-								description = author,
-								colour = result.colour)
-			em.set_footer(text = result.desc)
-			await message.channel.send(send, embed=em)
-		else:
-			await message.channel.send(send)
+	if command.executor == "pool":
+		# Keep long computations off the event loop
+		loop = asyncio.get_running_loop()
+		with metrics.stage("work"):
+			result = await loop.run_in_executor(None, contextvars.copy_context().run, command.handler, message, args)
+	else:
+		result = command.handler(message, args)
+		if asyncio.iscoroutine(result):
+			result = await result
 
-	elif parse.startswith(delete):
-		result = deleteCommand(message.content[len(delete):].strip())
-		await message.channel.send(result)
+	await reply(message, result)
 
-	elif parse.startswith(getCommandsList):
-		result = getCommands()
+def guildOf(message):
+	# Saved commands are kept per server, and together for direct messages
+	return message.guild.id if message.guild is not None else 0
 
-		if len(result) < 1000:
-			await message.channel.send(result)
-		else:
-			commands = result.split("\n")
+"""
+Command handlers
+Each takes the message and the text after the command's name, and
+returns what to reply with (see reply).
+"""
 
-			sendList = []
-			for n in (0, len(commands), 20):
-				sendList.append("\n".join(commands[n:n+20]))
+@router.command(doc, exact=True)
+def helpHandler(message, args):
+	return getHelpDoc()
 
-			for message in sendList:
-				await message.channel.send(message)
+@router.command(simpleHelp, exact=True)
+def simpleHelpHandler(message, args):
+	return simpleRollDoc
 
-	# Handle a tros command
-	elif parse.startswith(trosRoll):
+@router.command(cRollHelp, exact=True)
+def cRollHelpHandler(message, args):
+	return cRollDoc
 
-		roll = RoS(parse[len(trosRoll):])
-		result = roll.format()
+@router.command(trosRollHelp, exact=True)
+def trosRollHelpHandler(message, args):
+	return trosRollDoc
 
-		# If result was a string, something failed; send string.
-		if isinstance(result, str):
-			await message.channel.send(result)
+@router.command(saveHelp)
+def saveHelpHandler(message, args):
+	return getSaveDoc()
 
-		else:
-			em = discord.Embed(title = result.title,
-								description = author,
-								colour = result.colour)
-			em.set_footer(text = result.desc)
+@router.command(simpleRoll, cost="roll")
+async def rollHandler(message, args):
+	result, plan = await rollCommand(Roll, args.lower())
 
-			await message.channel.send(embed=em)
+	# If result was a string, something failed; send string.
+	if isinstance(result, str):
+		countFailure(result)
+	return result
 
-	# Handle a croll command
-	elif parse.startswith(cRoll):
-		roll = CoC(parse[len(cRoll):])
-		result = roll.format()
+@router.command(trosRoll, cost="roll")
+async def trosHandler(message, args):
+	result, plan = await rollCommand(RoS, args.lower())
+	if isinstance(result, str):
+		countFailure(result)
+	return result
 
-		# If result was a string, something failed; send string.
-		if isinstance(result, str):
-			await message.channel.send(result)
+@router.command(cRoll, cost="roll")
+async def cRollHandler(message, args):
+	result, plan = await rollCommand(CoC, args.lower())
+	if isinstance(result, str):
+		countFailure(result)
+	return result
 
-		else:
-			em = discord.Embed(title = result.title,
-								description = author,
-								colour = result.colour)
-			em.set_footer(text = result.desc)
+@router.command(cRollOdds)
+def cRollOddsHandler(message, args):
+	return getTierOdds(args.lower())
+
+@router.command(useSaved, cost="roll")
+async def savedHandler(message, args):
+	return await getCommand(args.strip(), guildOf(message))
+
+@router.command(save, cost="roll")
+async def saveHandler(message, args):
+	text, result = await saveCommand(args.strip(), guildOf(message))
+	if isinstance(result, str):
+		return text
+	return text, result
+
+@router.command(delete)
+def deleteHandler(message, args):
+	return deleteCommand(args.strip(), guildOf(message))
+
+@router.command(getCommandsList)
+def commandsHandler(message, args):
+	return getCommands(args.strip(), guildOf(message))
+
+@router.command(odds, cost="cpu", executor="pool")
+def oddsHandler(message, args):
+	result = getOdds(args.lower())
+	if isinstance(result, str):
+		countFailure(result)
+	return result
 
-			await message.channel.send(embed=em)
+@router.command(sim, cost="cpu", executor="pool")
+def simHandler(message, args):
+	result = getSim(args.lower())
+	if isinstance(result, str):
+		countFailure(result)
+	return result
 
-	elif message.content.startswith(mood):
-		await message.channel.send(getMood(message.content[len(mood):]))
+@router.command(mood, cost="io")
+async def moodHandler(message, args):
+	return await getMood(args)
 
-	elif parse.startswith(nameType):
-		await message.channel.send(getNameTypes())
+@router.command(nameType)
+def nameTypeHandler(message, args):
+	return getNameTypes()
 
-	elif parse.startswith(turn):
-		title, footer = getTurn(parse[len(turn):])
-		em = discord.Embed(title = title,
-							description = author,
-							colour = 0x2e71cc)
-		em.set_footer(text = footer)
+@router.command(name)
+def nameHandler(message, args):
+	return getName(args.strip().lower())
 
-		await message.channel.send(embed=em)
+@router.command(turn)
+def turnHandler(message, args):
+	title, footer = getTurn(args.lower())
+	em = discord.Embed(title = title,
+						description = rollAuthor(message),
+						colour = 0x2e71cc)
+	em.set_footer(text = footer)
 
-	elif parse.startswith(name):
-		await message.channel.send(getName(message.content[len(name):].strip().lower()))
+	return em
 
-	elif message.content.startswith(weather):
-		await message.channel.send(embed=getWeather(message.content[len(weather):].strip().lower()))
+@router.command(weather)
+def weatherHandler(message, args):
+	return getWeather(args.strip().lower())
+
+@router.command(stats, exact=True)
+def statsHandler(message, args):
+	if message.author.id not in owners:
+		return None
+
+	report = metrics.report()
+	if len(report) > 1990:
+		report = report[:report.rfind("\n", 0, 1990)]
+	return "```\n" + report + "\n```"
+
+@router.command(disconnect, exact=True)
+async def disconnectHandler(message, args):
+	await send(message.channel, "Dicey is disconnecting!")
+	await flushCommands()
+	await moodSearch.close()
+	rollExecutor.shutdown()
+	# TBD: find better disconnect method
+	raise KeyboardInterrupt
+
+async def chatter(message):
+	"""
+	Cute extras, for messages that aren't commands
+	"""
+	parse = message.content.lower()
 
-	# Cute extras
-	elif "badrobot" in parse.replace(" ", "") or "badbot" in parse.replace(" ", "") and "not" not in parse:
-		await message.channel.send(choice(badRobot))
+	if "badrobot" in parse.replace(" ", "") or "badbot" in parse.replace(" ", "") and "not" not in parse:
+		await send(message.channel, getRandom().choice(badRobot))
 
 	elif "goodrobot" in parse.replace(" ", "") or "goodbot" in parse.replace(" ", "") and "not" not in parse:
-		await message.channel.send(choice(goodRobot))
+		await send(message.channel, getRandom().choice(goodRobot))
 
 	elif "dicey" in parse and any([item in parse for item in greetRobot]):
 		# Don't want to interpret things like "dice yes" here
-		await message.channel.send(choice(greetings))
-
-	# Handle disconnect
-	elif message.content == disconnect:
-		await message.channel.send("Dicey is disconnecting!")
-		# TBD: find better disconnect method
-		raise KeyboardInterrupt
+		await send(message.channel, getRandom().choice(greetings))
 
 """
 Finally...
 we run the bot
 """
 
-client.run(token)
+if __name__ == "__main__":
+	# Given arguments, roll them without Discord; see diceBatch
+	if len(sys.argv) > 1:
+		from diceBatch import main
+		sys.exit(main())
+
+	from dicey_token import token
+	getClient().run(token)